@@ -0,0 +1,232 @@
+# In-process stand-ins for the GCP clients main.py imports, with injectable latency.
+#
+# install() must run before `import main`: it registers fake google.cloud.* / vertexai
+# modules in sys.modules so the app boots offline without credentials.
+import os
+import sys
+import threading
+import time
+import types
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+
+@dataclass
+class FakeLatency:
+    """Seconds each fake call sleeps before answering."""
+    vertex: float = 0.3
+    gcs: float = 0.015
+    video_intelligence: float = 1.0
+    pubsub: float = 0.001
+
+    @classmethod
+    def parse(cls, spec: Optional[str]) -> "FakeLatency":
+        """Parse "vertex=0.4,gcs=0.02" (seconds) over the defaults."""
+        latency = cls()
+        for part in (spec or "").split(","):
+            if not part.strip():
+                continue
+            name, _, value = part.partition("=")
+            name = name.strip()
+            if not hasattr(latency, name):
+                raise ValueError(f"unknown latency {name!r}")
+            setattr(latency, name, float(value))
+        return latency
+
+
+@dataclass
+class FakeStore:
+    """Objects served by the fake GCS bucket, seeded with a small live HLS rendition."""
+    objects: Dict[str, bytes] = field(default_factory=dict)
+    updated: Dict[str, datetime] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def put(self, path: str, data: bytes) -> None:
+        with self.lock:
+            self.objects[path] = data
+            self.updated[path] = datetime.now(timezone.utc)
+
+    def seed_live(self, prefix: str = "livestream/outputs/", segments: int = 6, segment_bytes: int = 256 * 1024) -> None:
+        lines = ["#EXTM3U", "#EXT-X-VERSION:6", "#EXT-X-TARGETDURATION:2", "#EXT-X-MEDIA-SEQUENCE:100"]
+        for i in range(segments):
+            name = f"segment_{100 + i:05d}.ts"
+            lines += ["#EXTINF:2.000,", name]
+            self.put(prefix + name, os.urandom(segment_bytes))
+        self.put(prefix + "manifest.m3u8", ("\n".join(lines) + "\n").encode("utf-8"))
+
+
+latency = FakeLatency()
+store = FakeStore()
+
+
+def _sleep(seconds: float) -> None:
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+# --- vertexai.generative_models ---
+class _GenerationResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.candidates = []
+
+
+class GenerativeModel:
+    def __init__(self, model_name: str, *args, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, *args, **kwargs) -> _GenerationResponse:
+        _sleep(latency.vertex)
+        words = str(prompt).split()
+        return _GenerationResponse(" ".join(words[-40:]) or "summary")
+
+
+# --- google.cloud.storage ---
+class _Blob:
+    def __init__(self, name: str):
+        self.name = name
+
+    def exists(self) -> bool:
+        _sleep(latency.gcs)
+        return self.name in store.objects
+
+    def download_as_bytes(self) -> bytes:
+        _sleep(latency.gcs)
+        return store.objects[self.name]
+
+    @property
+    def updated(self) -> Optional[datetime]:
+        return store.updated.get(self.name)
+
+    time_created = updated
+
+
+class _Bucket:
+    def __init__(self, name: str):
+        self.name = name
+
+    def blob(self, path: str) -> _Blob:
+        return _Blob(path)
+
+
+class StorageClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket(self, name: str) -> _Bucket:
+        return _Bucket(name)
+
+    def list_blobs(self, bucket, prefix: str = "", max_results: Optional[int] = None) -> List[_Blob]:
+        _sleep(latency.gcs)
+        names = sorted(n for n in store.objects if n.startswith(prefix))
+        return [_Blob(n) for n in names[:max_results]]
+
+
+# --- google.cloud.videointelligence_v1 ---
+class _Feature:
+    LABEL_DETECTION = 1
+    SHOT_CHANGE_DETECTION = 2
+    EXPLICIT_CONTENT_DETECTION = 3
+    TEXT_DETECTION = 7
+    OBJECT_TRACKING = 9
+
+
+class _Obj(types.SimpleNamespace):
+    pass
+
+
+class _Operation:
+    def result(self, timeout: Optional[float] = None):
+        _sleep(latency.video_intelligence)
+        labels = [_Obj(entity=_Obj(description=d)) for d in ("music", "concert", "crowd", "stage")]
+        shots = [_Obj() for _ in range(42)]
+        return _Obj(annotation_results=[_Obj(
+            shot_annotations=shots,
+            segment_label_annotations=labels,
+            text_annotations=[_Obj(text="LIVE")],
+            object_annotations=[_Obj(entity=_Obj(description="person"))],
+            explicit_annotation=None,
+        )])
+
+
+class VideoIntelligenceServiceClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def annotate_video(self, request=None, **kwargs) -> _Operation:
+        return _Operation()
+
+
+# --- google.cloud.pubsub_v1 ---
+class _Future:
+    def result(self, timeout: Optional[float] = None) -> str:
+        return "1"
+
+
+class PublisherClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def topic_path(self, project: str, topic: str) -> str:
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic: str, data: bytes, **attrs) -> _Future:
+        _sleep(latency.pubsub)
+        return _Future()
+
+
+# --- google.cloud.logging / aiplatform / bigquery ---
+class LoggingClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def setup_logging(self, *args, **kwargs) -> None:
+        pass
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    return mod
+
+
+def install(lat: Optional[FakeLatency] = None) -> None:
+    """Register the fakes in sys.modules (replacing any real client libraries)."""
+    global latency
+    if lat is not None:
+        latency = lat
+
+    google = sys.modules.get("google") or _module("google", __path__=[])
+    cloud = _module("google.cloud", __path__=[])
+    fakes = {
+        "aiplatform": _module("google.cloud.aiplatform", init=lambda **kwargs: None),
+        "logging": _module("google.cloud.logging", Client=LoggingClient),
+        "pubsub_v1": _module("google.cloud.pubsub_v1", PublisherClient=PublisherClient),
+        "bigquery": _module("google.cloud.bigquery", Client=object),
+        "storage": _module("google.cloud.storage", Client=StorageClient),
+        "videointelligence_v1": _module(
+            "google.cloud.videointelligence_v1",
+            Feature=_Feature,
+            VideoIntelligenceServiceClient=VideoIntelligenceServiceClient,
+        ),
+    }
+    sys.modules["google"] = google
+    sys.modules["google.cloud"] = cloud
+    google.cloud = cloud
+    for name, mod in fakes.items():
+        sys.modules[f"google.cloud.{name}"] = mod
+        setattr(cloud, name, mod)
+
+    vertexai = _module("vertexai", __path__=[])
+    vertexai.generative_models = _module("vertexai.generative_models", GenerativeModel=GenerativeModel)
+    sys.modules["vertexai"] = vertexai
+    sys.modules["vertexai.generative_models"] = vertexai.generative_models
+
+    # Keep Firebase Admin out of the picture: main.py treats it as optional
+    sys.modules["firebase_admin"] = None  # type: ignore[assignment]
+
+    os.environ.setdefault("PROJECT_ID", "bench-project")
+    os.environ.setdefault("MEDIA_BUCKET", "bench-media")
+    os.environ.pop("API_KEY", None)
+    store.seed_live()
@@ -0,0 +1,251 @@
+# Load/latency benchmark for the FastAPI app against in-process GCP fakes.
+#
+# From MyChannel/Backend:
+#   python -m bench.run                                   # default scenario, prints a table
+#   python -m bench.run --concurrency 32 --requests 400 --latency vertex=0.5,gcs=0.03
+#   python -m bench.run --save-baseline bench/baseline.json
+#   python -m bench.run --baseline bench/baseline.json    # exit 1 on regression
+#
+# Requests are driven straight through the ASGI interface (no sockets, no network), so the
+# numbers include routing, validation, middleware and the threadpool, but not uvicorn I/O.
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from bench import fakes
+
+
+@dataclass
+class RouteCase:
+    name: str
+    method: str
+    path: str
+    query: Optional[Dict[str, str]] = None
+    body: Optional[Dict[str, Any]] = None
+
+
+ROUTES: Dict[str, RouteCase] = {
+    "summarize": RouteCase("summarize", "POST", "/ai/summarize",
+                           body={"text": "A creator vlog about street food in Mexico City. " * 20, "lang": "en"}),
+    "scoreVirality": RouteCase("scoreVirality", "POST", "/ai/scoreVirality",
+                               body={"labels": ["music", "concert"], "shots": 80, "duration_seconds": 45,
+                                     "object_annotations": ["person"]}),
+    "live_playlist": RouteCase("live_playlist", "GET", "/live/playlist"),
+    "live_file": RouteCase("live_file", "GET", "/live/file", query={"path": "segment_00100.ts"}),
+}
+
+
+# --- Minimal in-process ASGI client ---
+async def asgi_request(app, case: RouteCase) -> Tuple[int, int]:
+    """Run one request through the app; returns (status, response body bytes)."""
+    body = json.dumps(case.body).encode("utf-8") if case.body is not None else b""
+    headers = [(b"host", b"bench"), (b"accept-encoding", b"gzip")]
+    if case.body is not None:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": case.method, "scheme": "http", "path": case.path, "raw_path": case.path.encode(),
+        "query_string": urlencode(case.query or {}).encode(), "root_path": "",
+        "headers": headers, "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    sent = False
+    status = 0
+    size = 0
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()  # never disconnects
+
+    async def send(message):
+        nonlocal status, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, size
+
+
+class Lifespan:
+    """Drive ASGI lifespan startup/shutdown so startup hooks run as under uvicorn."""
+
+    def __init__(self, app):
+        self.app = app
+        self._to_app: asyncio.Queue = asyncio.Queue()
+        self._from_app: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}}
+        self._task = asyncio.create_task(self.app(scope, self._to_app.get, self._from_app.put))
+        await self._to_app.put({"type": "lifespan.startup"})
+        msg = await self._from_app.get()
+        if msg["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"app startup failed: {msg}")
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._to_app.put({"type": "lifespan.shutdown"})
+        await self._from_app.get()
+        await self._task
+
+
+# --- Measurement ---
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+async def drive(app, case: RouteCase, total: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            status, _ = await asgi_request(app, case)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def measure_memory(app, case: RouteCase, total: int, concurrency: int) -> float:
+    """Peak traced Python allocation (KiB) while serving `total` requests; run separately since tracing skews latency."""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        await drive(app, case, total, concurrency)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(0.0, (peak - base) / 1024.0)
+
+
+async def run_suite(routes: List[str], total: int, concurrency: int, warmup: int, memory_requests: int) -> Dict[str, Any]:
+    import main  # imported after fakes.install()
+
+    results: Dict[str, Any] = {}
+    async with Lifespan(main.app):
+        for name in routes:
+            case = ROUTES[name]
+            await drive(main.app, case, warmup, min(concurrency, max(1, warmup)))
+            stats = await drive(main.app, case, total, concurrency)
+            if memory_requests:
+                stats["peak_mem_kib"] = await measure_memory(main.app, case, memory_requests, concurrency)
+            results[name] = stats
+    return results
+
+
+# --- Reporting / baselines ---
+# (metric, higher_is_worse)
+_COMPARED: List[Tuple[str, bool]] = [("p50_ms", True), ("p95_ms", True), ("p99_ms", True),
+                                     ("throughput_rps", False), ("peak_mem_kib", True)]
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Human-readable regressions beyond `tolerance` (fractional) versus the baseline."""
+    regressions = []
+    for route, stats in current["routes"].items():
+        base = baseline.get("routes", {}).get(route)
+        if not base:
+            continue
+        for metric, higher_is_worse in _COMPARED:
+            if metric not in stats or metric not in base or not base[metric]:
+                continue
+            change = (stats[metric] - base[metric]) / base[metric]
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append(f"{route}.{metric}: {base[metric]:.1f} -> {stats[metric]:.1f} ({change:+.0%})")
+        if stats.get("errors", 0) > base.get("errors", 0):
+            regressions.append(f"{route}.errors: {base.get('errors', 0)} -> {stats['errors']}")
+    return regressions
+
+
+def print_table(results: Dict[str, Any], out: Callable[[str], None] = print) -> None:
+    out(f"{'route':<16}{'reqs':>7}{'err':>6}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mem KiB':>11}")
+    for name, s in results.items():
+        mem = f"{s['peak_mem_kib']:.0f}" if "peak_mem_kib" in s else "-"
+        out(f"{name:<16}{s['requests']:>7}{s['errors']:>6}{s['throughput_rps']:>10.1f}"
+            f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{mem:>11}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the MyChannel backend against in-process GCP fakes.")
+    parser.add_argument("--routes", default=",".join(ROUTES), help=f"Comma-separated subset of: {', '.join(ROUTES)}")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--memory-requests", type=int, default=50, help="Requests in the traced memory pass (0 disables)")
+    parser.add_argument("--latency", default="", help="Injected fake latencies in seconds, e.g. vertex=0.4,gcs=0.02,video_intelligence=1,pubsub=0")
+    parser.add_argument("--out", help="Write results JSON here")
+    parser.add_argument("--save-baseline", help="Write results JSON as the new baseline")
+    parser.add_argument("--baseline", help="Compare against this baseline JSON and exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed fractional regression (default 0.15)")
+    args = parser.parse_args(argv)
+
+    routes = [r.strip() for r in args.routes.split(",") if r.strip()]
+    unknown = [r for r in routes if r not in ROUTES]
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(unknown)}")
+
+    latency = fakes.FakeLatency.parse(args.latency)
+    fakes.install(latency)
+    results = asyncio.run(run_suite(routes, args.requests, args.concurrency, args.warmup, args.memory_requests))
+    report = {
+        "config": {"requests": args.requests, "concurrency": args.concurrency, "latency": asdict(latency)},
+        "routes": results,
+    }
+    print_table(results)
+
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print("warning: baseline was recorded with a different config", file=sys.stderr)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%} versus {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+# Per-route-class bulkheads: each class of blocking work (health, live media, interactive AI,
+# long-running AI) gets its own thread pool and admission queue instead of sharing Starlette's
+# single threadpool, so a pile-up of five-minute video analyses cannot delay segment serving
+# or make Cloud Run health checks time out.
+#
+# Sizes come from BULKHEAD_<NAME>_WORKERS / _QUEUE / _TIMEOUT (e.g. BULKHEAD_LONG_AI_WORKERS=4).
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+class BulkheadFull(Exception):
+    """The pool's queue is full or the wait for a worker exceeded its queue timeout."""
+
+    def __init__(self, name: str, reason: str, retry_after: float):
+        super().__init__(f"{name} bulkhead {reason}")
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Bulkhead:
+    """A bounded thread pool with an admission queue.
+
+    At most `workers` calls run at once; up to `queue_size` more wait, each for at most
+    `queue_timeout` seconds, and anything beyond that is rejected straight away. A slot is
+    only released when the worker thread actually finishes, so a cancelled request (client
+    went away) cannot let more blocking calls run than the pool allows.
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"bulkhead-{name}")
+        self.active = 0
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waits: Deque[float] = deque(maxlen=512)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @classmethod
+    def from_env(cls, name: str, workers: int, queue_size: int, queue_timeout: float) -> "Bulkhead":
+        key = f"BULKHEAD_{name.upper()}"
+        return cls(
+            name,
+            workers=int(os.environ.get(f"{key}_WORKERS", str(workers))),
+            queue_size=int(os.environ.get(f"{key}_QUEUE", str(queue_size))),
+            queue_timeout=float(os.environ.get(f"{key}_TIMEOUT", str(queue_timeout))),
+        )
+
+    async def _acquire(self) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        # Counters move synchronously, so this is exact even before any waiter gets scheduled
+        if self.active + self.queued >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise BulkheadFull(self.name, "queue full", self.queue_timeout)
+        started = time.perf_counter()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise BulkheadFull(self.name, "queue timeout", self.queue_timeout)
+        finally:
+            self.queued -= 1
+        self._waits.append(time.perf_counter() - started)
+        self.active += 1
+
+    def _release(self, ok: bool) -> None:
+        self.active -= 1
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+        self._semaphore.release()
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run blocking `fn(*args, **kwargs)` on this pool once admitted."""
+        await self._acquire()
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        try:
+            future = self.executor.submit(context.run, functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release(False)
+            raise
+        def done(f) -> None:
+            try:
+                loop.call_soon_threadsafe(self._release, not f.cancelled() and f.exception() is None)
+            except RuntimeError:
+                pass  # the loop closed first (shutdown): nothing is left to admit
+
+        future.add_done_callback(done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "queued": self.queued,
+            "queue_size": self.queue_size,
+            "queue_timeout_s": self.queue_timeout,
+            "saturation": round(self.active / self.workers, 3) if self.workers else 1.0,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_p95_ms": round(p95 * 1000, 1),
+        }
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Bulkheads:
+    """Named bulkheads plus a decorator that moves a sync route onto one of them."""
+
+    def __init__(self, *pools: Bulkhead):
+        self.pools: Dict[str, Bulkhead] = {pool.name: pool for pool in pools}
+
+    def __getitem__(self, name: str) -> Bulkhead:
+        return self.pools[name]
+
+    def isolate(self, name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """Wrap a sync route as an async one that runs on bulkhead `name`.
+
+        functools.wraps keeps the signature, so FastAPI still resolves the original parameters.
+        """
+        pool = self.pools[name]
+
+        def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+            @functools.wraps(fn)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                return await pool.run(fn, *args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+    def shutdown(self) -> None:
+        for pool in self.pools.values():
+            pool.shutdown()
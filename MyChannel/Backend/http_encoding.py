@@ -0,0 +1,158 @@
+# Response compression (gzip/brotli) and strong ETags for the FastAPI app.
+# Mirrors functions/http_encoding.py so both deployables negotiate identically.
+import gzip
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# --- Shared with functions/ and MyChannel/Backend/ http_encoding.py: keep this section identical ---
+try:
+    # Brotli is optional; gzip is always available
+    import brotli
+except Exception:  # pragma: no cover - optional
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+_ENCODING_SUFFIX = {"br": "-br", "gzip": "-gzip"}
+
+
+def strong_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _base_tag(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in _ENCODING_SUFFIX.values():
+        if tag.endswith(suffix + '"'):
+            return tag[: -len(suffix) - 1] + '"'
+    return tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison; encoding suffixes are ignored so any representation matches."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    base = _base_tag(etag)
+    return any(_base_tag(candidate) == base for candidate in if_none_match.split(","))
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the acceptable encoding with the highest q-value (br on a tie); None means identity."""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    star = weights.get("*", 0.0)
+    best: Optional[str] = None
+    best_q = 0.0
+    for name in ("br", "gzip"):
+        if name == "br" and brotli is None:
+            continue
+        q = weights.get(name, star)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def variant_etag(etag: str, encoding: Optional[str]) -> str:
+    """The ETag of `encoding`'s representation (the base tag for identity)."""
+    return etag[:-1] + _ENCODING_SUFFIX[encoding] + '"' if encoding else etag
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        # Quality 5 keeps dynamic compression cheap while still beating gzip
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+# --- End of shared section ---
+
+_COMPRESSIBLE_TYPES = ("application/json", "application/vnd.apple.mpegurl", "text/")
+
+
+class EncodingMiddleware:
+    """Buffers each response, answers conditional GET/HEAD with 304 and compresses text bodies.
+
+    Only complete, uncompressed 200 responses get an ETag; media segments pass through
+    uncompressed but still carry an ETag so players can revalidate cheaply.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        method = scope["method"]
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            await self._finish(start, b"".join(chunks), request_headers, method, send)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _finish(self, start: Message, body: bytes, request_headers: Headers, method: str, send: Send) -> None:
+        status = start["status"]
+        headers = MutableHeaders(raw=list(start.get("headers", [])))
+        content_type = headers.get("content-type", "")
+        already_encoded = "content-encoding" in headers
+
+        encoding: Optional[str] = None
+        if not already_encoded and len(body) >= self.minimum_size and content_type.startswith(_COMPRESSIBLE_TYPES):
+            headers.add_vary_header("Accept-Encoding")
+            encoding = negotiate_encoding(request_headers.get("accept-encoding"))
+
+        if status == 200 and method in ("GET", "HEAD") and not already_encoded:
+            # Routes that cache their bodies (live segments/playlists) set the ETag once up front;
+            # anything else is hashed here. A 304 names the same representation (and keeps the
+            # same Vary) as the 200 would, so shared caches revalidate the right encoding.
+            etag = variant_etag(headers.get("etag") or strong_etag(body), encoding)
+            headers["ETag"] = etag
+            if etag_matches(request_headers.get("if-none-match"), etag):
+                del headers["content-length"]
+                if "content-type" in headers:
+                    del headers["content-type"]
+                await send({"type": "http.response.start", "status": 304, "headers": headers.raw})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        if encoding:
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+
+        await send({"type": "http.response.start", "status": status, "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,346 @@
+# Ingestion worker: drains the `video-features` topic into the analytics store.
+# Run from MyChannel/Backend (same image as the API):
+#
+#   python ingest_worker.py --sink bigquery --table analytics.video_features
+#   PUBSUB_EMULATOR_HOST=localhost:8085 python ingest_worker.py --project demo-mychannel \
+#       --create-subscription --sink sqlite --sqlite-path /tmp/video_features.db
+#
+# Messages are pulled with flow control and buffered into micro-batches; each batch is
+# committed with one BigQuery load job (or one SQLite transaction) and only then are its
+# messages acked, so a failed commit leaves them to be redelivered. Rows are de-duplicated
+# by (video_id, ingested_at) against the open batch and a bounded window of recently
+# committed keys; the SQLite sink also enforces it with a unique index.
+import argparse
+import json
+import logging
+import os
+import signal
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("mychannel")
+
+PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT") or os.environ.get("PROJECT_ID")
+FEATURES_TOPIC = "video-features"
+FEATURES_SUBSCRIPTION = os.environ.get("FEATURES_SUBSCRIPTION", "video-features-ingest")
+FEATURES_TABLE = os.environ.get("FEATURES_TABLE", "analytics.video_features")
+
+# Matches google_bigquery_table.video_features in infra/terraform/main.tf
+REPEATED_COLUMNS = ("labels", "text_annotations", "object_annotations")
+FEATURE_COLUMNS = ("ingested_at", "video_id", "uri", "labels", "shots", "explicit_content",
+                   "text_annotations", "object_annotations", "duration_seconds")
+
+
+def feature_row(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Map one published features event onto the video_features table schema."""
+    ingested_at = payload.get("ingested_at")
+    if isinstance(ingested_at, (int, float)):
+        ingested_at = datetime.fromtimestamp(ingested_at, tz=timezone.utc).isoformat()
+    row = {column: payload.get(column) for column in FEATURE_COLUMNS}
+    row["ingested_at"] = ingested_at
+    for column in REPEATED_COLUMNS:
+        row[column] = list(row[column] or [])
+    return row
+
+
+def row_key(row: Dict[str, Any]) -> Tuple[str, str]:
+    return (row.get("video_id") or row.get("uri") or "", str(row.get("ingested_at") or ""))
+
+
+class RecentKeys:
+    """Bounded LRU set of recently committed row keys, to drop Pub/Sub redeliveries."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._keys: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self._keys
+
+    def add_all(self, keys) -> None:
+        for key in keys:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+        while len(self._keys) > self.max_keys:
+            self._keys.popitem(last=False)
+
+
+# --- Sinks: write(rows) commits the whole batch or raises ---
+class BigQuerySink:
+    """Appends each batch with a single load job (free, and no per-row streaming quota).
+
+    BigQuery allows 1,500 load jobs per table per day, shared by every replica and including
+    failed jobs. The default 5-minute flush uses 288 a day, leaving room for retries and a
+    second replica; see --batch-seconds and --batch-rows.
+    """
+
+    def __init__(self, table: str, project: Optional[str] = None):
+        from google.cloud import bigquery
+
+        self._bigquery = bigquery
+        self.client = bigquery.Client(project=project)
+        self.table = table if table.count(".") == 2 else f"{self.client.project}.{table}"
+        self.job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            ignore_unknown_values=True,
+        )
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        job = self.client.load_table_from_json(rows, self.table, job_config=self.job_config)
+        job.result()  # raises on failure, so the batch is nacked
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class SqliteSink:
+    """Local sink for emulator runs and tests; repeated columns are stored as JSON text."""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS video_features ("
+            "ingested_at TEXT, video_id TEXT, uri TEXT, labels TEXT, shots INTEGER, explicit_content INTEGER, "
+            "text_annotations TEXT, object_annotations TEXT, duration_seconds REAL)"
+        )
+        self.conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS video_features_key ON video_features (video_id, ingested_at)"
+        )
+        self.conn.commit()
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        values = [
+            tuple(json.dumps(row[c]) if c in REPEATED_COLUMNS else row[c] for c in FEATURE_COLUMNS)
+            for row in rows
+        ]
+        with self.conn:  # one transaction per batch
+            self.conn.executemany(
+                f"INSERT OR IGNORE INTO video_features ({', '.join(FEATURE_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in FEATURE_COLUMNS)})",
+                values,
+            )
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class IngestStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.received = 0
+        self.duplicates = 0
+        self.malformed = 0
+        self.committed = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {name: value for name, value in vars(self).items() if not name.startswith("_")}
+
+
+class MicroBatcher:
+    """Buffers Pub/Sub messages and commits them to `sink` in batches.
+
+    `submit` is called from the subscriber's callback threads; a single flusher thread commits
+    a batch when it reaches `max_rows`/`max_bytes` or its oldest message is `max_seconds` old.
+    Messages are acked after their batch commits and nacked if the commit fails.
+    """
+
+    def __init__(self, sink, max_rows: int = 5000, max_bytes: int = 8 * 1024 * 1024,
+                 max_seconds: float = 300.0, recent_keys: int = 100_000):
+        self.sink = sink
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.stats = IngestStats()
+        self._recent = RecentKeys(recent_keys)
+        self._cond = threading.Condition()
+        self._rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._messages: List[Any] = []
+        self._bytes = 0
+        self._opened = 0.0
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="ingest-flusher", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def submit(self, message) -> None:
+        try:
+            row = feature_row(json.loads(message.data.decode("utf-8")))
+        except (ValueError, AttributeError, TypeError, OverflowError, OSError) as e:
+            # Redelivering a poison message would never succeed; log and drop it
+            # (OverflowError/OSError: an epoch ingested_at outside the platform's range)
+            logger.warning("Dropping malformed video-features message %s: %s", message.message_id, e)
+            self.stats.add(received=1, malformed=1)
+            message.ack()
+            return
+        key = row_key(row)
+        with self._cond:
+            if self._stopping:
+                # The final batch is already committing; let another worker (or restart) take it
+                message.nack()
+                return
+            if key in self._recent:
+                self.stats.add(received=1, duplicates=1)
+                message.ack()
+                return
+            if key in self._rows:
+                self.stats.add(received=1, duplicates=1)
+            else:
+                self.stats.add(received=1)
+                self._rows[key] = row
+                self._bytes += len(message.data)
+            if not self._messages:
+                self._opened = time.monotonic()
+            self._messages.append(message)  # duplicates of an open row are acked with its batch
+            if len(self._rows) >= self.max_rows or self._bytes >= self.max_bytes:
+                self._cond.notify()
+
+    def _due(self) -> bool:
+        if not self._messages:
+            return False
+        return (len(self._rows) >= self.max_rows or self._bytes >= self.max_bytes
+                or time.monotonic() - self._opened >= self.max_seconds)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopping and not self._due():
+                    timeout = self.max_seconds - (time.monotonic() - self._opened) if self._messages else None
+                    self._cond.wait(timeout)
+                if self._stopping and not self._messages:
+                    return
+                rows, messages = self._rows, self._messages
+                self._rows, self._messages, self._bytes = {}, [], 0
+            self._commit(rows, messages)
+
+    def _commit(self, rows: Dict[Tuple[str, str], Dict[str, Any]], messages: List[Any]) -> None:
+        started = time.perf_counter()
+        try:
+            if rows:
+                self.sink.write(list(rows.values()))
+        except Exception as e:
+            logger.error("Committing %d video-features rows failed, nacking for redelivery: %s", len(rows), e)
+            self.stats.add(failed_batches=1)
+            for message in messages:
+                message.nack()
+            return
+        with self._cond:
+            self._recent.add_all(rows.keys())
+        for message in messages:
+            message.ack()
+        self.stats.add(committed=len(rows), batches=1)
+        logger.info("Committed %d video-features rows (%d messages) in %.0f ms",
+                    len(rows), len(messages), (time.perf_counter() - started) * 1000)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Commit whatever is buffered and stop the flusher thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+
+def ensure_subscription(project: str, subscription: str, ack_deadline: int = 60) -> None:
+    """Create the topic and pull subscription if missing (for the Pub/Sub emulator)."""
+    from google.api_core.exceptions import AlreadyExists
+    from google.cloud import pubsub_v1
+
+    publisher = pubsub_v1.PublisherClient()
+    subscriber = pubsub_v1.SubscriberClient()
+    topic_path = publisher.topic_path(project, FEATURES_TOPIC)
+    subscription_path = subscriber.subscription_path(project, subscription)
+    try:
+        publisher.create_topic(name=topic_path)
+    except AlreadyExists:
+        pass
+    try:
+        subscriber.create_subscription(name=subscription_path, topic=topic_path, ack_deadline_seconds=ack_deadline)
+    except AlreadyExists:
+        pass
+    subscriber.close()
+
+
+def run_worker(project: str, subscription: str, batcher: MicroBatcher, max_messages: int, max_bytes: int) -> None:
+    """Stream-pull until SIGINT/SIGTERM, then commit the open batch and exit.
+
+    The batcher stops first, while the streaming pull is still running: acks only queue on the
+    subscriber's dispatcher, so the last batch's acks are lost if the pull is cancelled before
+    they are sent, and every restart would load that batch again.
+    """
+    from google.cloud import pubsub_v1
+
+    subscriber = pubsub_v1.SubscriberClient()
+    subscription_path = subscriber.subscription_path(project, subscription)
+    # Outstanding (un-acked) messages include those waiting in the open batch, so this also
+    # bounds how many rows the worker holds in memory
+    flow_control = pubsub_v1.types.FlowControl(max_messages=max_messages, max_bytes=max_bytes)
+    batcher.start()
+    future = subscriber.subscribe(subscription_path, callback=batcher.submit, flow_control=flow_control)
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    logger.info("Ingesting %s into %s", subscription_path, type(batcher.sink).__name__)
+    try:
+        while not stop.wait(30.0) and not future.done():
+            logger.info("Ingest stats: %s", batcher.stats.as_dict())
+    finally:
+        batcher.stop(timeout=120)
+        future.cancel()
+        try:
+            future.result(timeout=30)
+        except Exception:
+            pass
+        subscriber.close()
+        batcher.sink.close()
+        logger.info("Ingest stopped: %s", batcher.stats.as_dict())
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Batch video-features messages into BigQuery (or SQLite).")
+    parser.add_argument("--project", default=PROJECT_ID)
+    parser.add_argument("--subscription", default=FEATURES_SUBSCRIPTION)
+    parser.add_argument("--create-subscription", action="store_true", help="Create topic/subscription if missing (emulator)")
+    parser.add_argument("--sink", choices=("bigquery", "sqlite"), default="bigquery")
+    parser.add_argument("--table", default=FEATURES_TABLE, help="BigQuery [project.]dataset.table")
+    parser.add_argument("--sqlite-path", default="video_features.db")
+    parser.add_argument("--batch-rows", type=int, default=5000)
+    parser.add_argument("--batch-bytes", type=int, default=8 * 1024 * 1024)
+    # Every committed batch is one BigQuery load job, limited to 1,500 per table per day across all
+    # replicas (failed jobs count too): 300 s is 288 jobs/day per replica; 60 s would be 1,440
+    parser.add_argument("--batch-seconds", type=float, default=300.0,
+                        help="Max age of a batch before it is committed (one load job per batch; 1,500/table/day quota)")
+    parser.add_argument("--max-outstanding", type=int, default=20000, help="Flow control: max un-acked messages")
+    parser.add_argument("--max-outstanding-bytes", type=int, default=64 * 1024 * 1024)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.project:
+        parser.error("--project (or GOOGLE_CLOUD_PROJECT) is required")
+    if args.max_outstanding <= args.batch_rows:
+        logger.warning("--max-outstanding <= --batch-rows: batches will only flush on --batch-seconds")
+    if args.sink == "bigquery" and 86400 / args.batch_seconds > 1000:
+        logger.warning("--batch-seconds %.0f allows %.0f load jobs/day per replica; BigQuery's limit is 1,500 "
+                       "per table per day", args.batch_seconds, 86400 / args.batch_seconds)
+
+    if args.create_subscription:
+        ensure_subscription(args.project, args.subscription)
+    sink = BigQuerySink(args.table, args.project) if args.sink == "bigquery" else SqliteSink(args.sqlite_path)
+    batcher = MicroBatcher(sink, max_rows=args.batch_rows, max_bytes=args.batch_bytes, max_seconds=args.batch_seconds)
+    run_worker(args.project, args.subscription, batcher, args.max_outstanding, args.max_outstanding_bytes)
+
+
+if __name__ == "__main__":
+    main()
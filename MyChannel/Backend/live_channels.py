@@ -0,0 +1,316 @@
+# Multi-channel live proxy state: per-channel playlists/status, one SegmentCache whose byte budget
+# is shared by every channel, and one FetchScheduler that shares GCS read concurrency fairly.
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from live_hls import PlaylistVersion, PlaylistWatcher, Prefetcher, SegmentCache, upcoming_uris
+
+logger = logging.getLogger("mychannel")
+
+CHANNEL_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,62}$")
+
+# Scheduler priorities: viewers (playlists, on-demand segments) go before background prefetch
+PRIORITY_VIEWER = 0
+PRIORITY_PREFETCH = 1
+
+
+class _ChannelQueue:
+    def __init__(self):
+        self.waiters: Tuple[Deque[asyncio.Future], ...] = (deque(), deque())
+        self.inflight = 0
+        self.bytes = 0.0  # exponentially decayed bytes read, for fair share
+        self.updated = time.monotonic()
+
+    def decayed_bytes(self, now: float, half_life: float) -> float:
+        return self.bytes * 0.5 ** ((now - self.updated) / half_life)
+
+    def next_waiter(self) -> Optional[asyncio.Future]:
+        for queue in self.waiters:
+            while queue:
+                fut = queue.popleft()
+                if not fut.cancelled():
+                    return fut
+        return None
+
+    def has_waiters(self) -> bool:
+        return any(fut for queue in self.waiters for fut in queue if not fut.cancelled())
+
+
+class FetchScheduler:
+    """Fair-share gate in front of blocking GCS reads.
+
+    At most `max_concurrency` reads run at once, and no channel holds more than
+    `per_channel` of them. When a slot frees up it goes to the waiting channel that has
+    read the fewest bytes recently (decayed with `half_life` seconds), so one popular stream
+    cannot starve the rest; within a channel, viewer reads go before prefetch. Admitted reads
+    run through `run_blocking` (Starlette's threadpool unless the app supplies its own pool).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        per_channel: int = 4,
+        half_life: float = 5.0,
+        run_blocking: Callable[..., Awaitable[Any]] = run_in_threadpool,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_channel = per_channel
+        self.half_life = half_life
+        self.run_blocking = run_blocking
+        self.inflight = 0
+        self._channels: Dict[str, _ChannelQueue] = {}
+
+    def _queue(self, channel_id: str) -> _ChannelQueue:
+        queue = self._channels.get(channel_id)
+        if queue is None:
+            queue = self._channels[channel_id] = _ChannelQueue()
+        return queue
+
+    def _grant(self, channel: _ChannelQueue) -> None:
+        channel.inflight += 1
+        self.inflight += 1
+
+    def _release(self, channel_id: str, nbytes: int) -> None:
+        channel = self._channels[channel_id]
+        now = time.monotonic()
+        channel.bytes = channel.decayed_bytes(now, self.half_life) + nbytes
+        channel.updated = now
+        channel.inflight -= 1
+        self.inflight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self.inflight < self.max_concurrency:
+            eligible = [c for c in self._channels.values() if c.inflight < self.per_channel and c.has_waiters()]
+            if not eligible:
+                return
+            channel = min(eligible, key=lambda c: c.decayed_bytes(now, self.half_life))
+            fut = channel.next_waiter()
+            if fut is None:
+                continue
+            self._grant(channel)
+            fut.set_result(None)
+
+    async def _acquire(self, channel_id: str, priority: int) -> None:
+        channel = self._queue(channel_id)
+        fut = asyncio.get_running_loop().create_future()
+        channel.waiters[priority].append(fut)
+        self._dispatch()  # grants immediately when a fair slot is free
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Slot was granted just as we were cancelled: hand it on
+                self._release(channel_id, 0)
+            raise
+
+    async def run(self, channel_id: str, fn: Callable[..., Any], *args: Any, priority: int = PRIORITY_VIEWER) -> Any:
+        """Run blocking `fn(*args)` once this channel gets a fair slot."""
+        await self._acquire(channel_id, priority)
+        nbytes = 0
+        try:
+            result = await self.run_blocking(fn, *args)
+            if isinstance(result, (bytes, bytearray)):
+                nbytes = len(result)
+            return result
+        finally:
+            self._release(channel_id, nbytes)
+
+    def forget(self, channel_id: str) -> None:
+        channel = self._channels.get(channel_id)
+        if channel is not None and channel.inflight == 0 and not channel.has_waiters():
+            del self._channels[channel_id]
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "inflight": self.inflight,
+            "channels": {
+                cid: {"inflight": c.inflight, "queued": sum(len(q) for q in c.waiters),
+                      "recent_bytes": int(c.decayed_bytes(now, self.half_life))}
+                for cid, c in self._channels.items()
+            },
+        }
+
+
+class LiveChannel:
+    """Everything one channel needs: playlist watchers, prefetcher and cached status.
+
+    Segments live in the shared `cache` (keyed by full object path), so the total cached bytes
+    stay within one budget however many channels are active.
+    """
+
+    def __init__(
+        self,
+        channel_id: str,
+        prefix: str,
+        scheduler: FetchScheduler,
+        read_bytes: Callable[[str], bytes],
+        file_url: str,
+        cache: SegmentCache,
+        poll_interval: float = 0.25,
+        max_block: float = 12.0,
+        prefetch_concurrency: int = 4,
+        prefetch_segments: int = 3,
+    ):
+        self.id = channel_id
+        self.prefix = prefix
+        self.scheduler = scheduler
+        self.read_bytes = read_bytes
+        self.file_url = file_url
+        self.poll_interval = poll_interval
+        self.max_block = max_block
+        self.prefetch_segments = prefetch_segments
+        self.cache = cache
+        self.prefetcher = Prefetcher(self.cache, self._prefetch_read, max_concurrency=prefetch_concurrency)
+        self.watchers: Dict[str, PlaylistWatcher] = {}
+        self.status: Any = None
+        self.status_expires = 0.0
+        self.last_access = time.monotonic()
+
+    async def _viewer_read(self, path: str) -> bytes:
+        return await self.scheduler.run(self.id, self.read_bytes, path, priority=PRIORITY_VIEWER)
+
+    async def _prefetch_read(self, path: str) -> bytes:
+        return await self.scheduler.run(self.id, self.read_bytes, path, priority=PRIORITY_PREFETCH)
+
+    def touch(self) -> None:
+        self.last_access = time.monotonic()
+
+    def watcher(self, relative_path: str) -> PlaylistWatcher:
+        watcher = self.watchers.get(relative_path)
+        if watcher is None:
+            self._prune_watchers()
+            base_dir = relative_path.rsplit("/", 1)[0] + "/" if "/" in relative_path else ""
+            watcher = self.watchers[relative_path] = PlaylistWatcher(
+                self.prefix + relative_path,
+                self._viewer_read,
+                base_dir=base_dir,
+                file_url=self.file_url,
+                poll_interval=self.poll_interval,
+                max_block=self.max_block,
+                on_update=self._prefetch_upcoming,
+            )
+        return watcher
+
+    async def playlist(
+        self, relative_path: str, msn: Optional[int] = None, part: Optional[int] = None
+    ) -> Optional[PlaylistVersion]:
+        """Latest version of a playlist, or (with `msn`) the first one containing msn/part.
+
+        A watcher whose first fetch fails (e.g. a client asked for a path that does not exist)
+        is dropped again, so only playlists that actually exist keep state around.
+        """
+        watcher = self.watcher(relative_path)
+        try:
+            if msn is None:
+                return await watcher.latest()
+            return await watcher.wait_for(msn, part)
+        except Exception:
+            if watcher.version is None and self.watchers.get(relative_path) is watcher:
+                del self.watchers[relative_path]
+            raise
+
+    def _prune_watchers(self) -> None:
+        # A watcher nobody has requested (or blocked on) for idle_timeout is just state
+        for path in [p for p, w in self.watchers.items() if not w.active()]:
+            del self.watchers[path]
+
+    async def segment(self, relative_path: str) -> Tuple[bytes, str]:
+        """Segment body and its ETag, from the cache when possible."""
+        path = self.prefix + relative_path
+        data = await self.cache.fetch(path, self._viewer_read)
+        return data, self.cache.etag(path, data)
+
+    def _prefetch_upcoming(self, watcher: PlaylistWatcher, version: PlaylistVersion) -> None:
+        """On each manifest update, warm what viewers will request next: newest segments/parts go
+        into the segment cache, referenced sub-playlists get their own watcher (which prefetches in turn)."""
+        text = version.raw.decode("utf-8", errors="ignore")
+        segments = []
+        for uri in upcoming_uris(text, version.state, self.prefetch_segments):
+            if "://" in uri or uri.startswith("/") or ".." in uri:
+                continue
+            relative = watcher.base_dir + uri.split("?", 1)[0]
+            if relative.lower().endswith(".m3u8"):
+                sub = self.watchers.get(relative)
+                if sub is None or sub.version is None:
+                    task = asyncio.get_running_loop().create_task(self.playlist(relative))
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            else:
+                segments.append(self.prefix + relative)
+        self.prefetcher.schedule(segments)
+
+    async def cached_status(self, compute: Callable[[str], Any], ttl: float) -> Any:
+        """Per-channel status, recomputed (through the scheduler) at most once per `ttl` seconds."""
+        now = time.monotonic()
+        if self.status is None or now >= self.status_expires:
+            self.status = await self.scheduler.run(self.id, compute, self.prefix)
+            self.status_expires = now + ttl
+        return self.status
+
+    def close(self) -> None:
+        self.cache.discard_prefix(self.prefix)
+        self.watchers.clear()
+
+    def idle(self, now: float, idle_ttl: float) -> bool:
+        active = any(w.active() for w in self.watchers.values())
+        return not active and now - self.last_access > idle_ttl
+
+
+class ChannelRegistry:
+    """Creates channels on first use and drops ones idle for longer than `idle_ttl` seconds.
+
+    Pruning happens when a channel is created and on a timer (see prune_periodically), so the
+    state of channels nobody watches is released even when no new channel arrives.
+    """
+
+    def __init__(self, factory: Callable[[str], LiveChannel], max_channels: int = 64, idle_ttl: float = 600.0):
+        self.factory = factory
+        self.max_channels = max_channels
+        self.idle_ttl = idle_ttl
+        self.channels: Dict[str, LiveChannel] = {}
+
+    def get(self, channel_id: str) -> LiveChannel:
+        if not CHANNEL_ID_RE.match(channel_id):
+            raise ValueError("invalid channel id")
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            self.prune()
+            if len(self.channels) >= self.max_channels:
+                raise LookupError("too many active channels")
+            channel = self.channels[channel_id] = self.factory(channel_id)
+        channel.touch()
+        return channel
+
+    def _drop(self, channel_id: str) -> None:
+        channel = self.channels.pop(channel_id)
+        channel.scheduler.forget(channel_id)
+        channel.close()
+        logger.info("Dropped idle live channel %s", channel_id)
+
+    def prune(self) -> None:
+        now = time.monotonic()
+        for cid in [cid for cid, c in self.channels.items() if c.idle(now, self.idle_ttl)]:
+            self._drop(cid)
+        for channel in self.channels.values():
+            channel._prune_watchers()
+        if len(self.channels) >= self.max_channels:
+            # Full: make room by evicting the least recently used channel nobody is watching
+            inactive = [c for c in self.channels.values() if c.idle(now, 0.0)]
+            if inactive:
+                self._drop(min(inactive, key=lambda c: c.last_access).id)
+
+    async def prune_periodically(self, interval: float = 60.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.prune()
+            except Exception as e:
+                logger.warning("Live channel prune failed: %s", e)
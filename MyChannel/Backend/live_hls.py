@@ -0,0 +1,390 @@
+# Live HLS proxy helpers: playlist parsing/rewriting, LL-HLS blocking playlist reload and
+# predictive segment prefetch. Loaders are async callables so the caller decides how GCS
+# reads are scheduled (see live_channels.FetchScheduler).
+#
+# One PlaylistWatcher per playlist object polls GCS while anyone is watching and publishes each
+# new version through an asyncio.Condition, so every viewer blocked on `_HLS_msn`/`_HLS_part`
+# is answered from the same fetch instead of re-polling the bucket itself. Each new version is
+# also handed to an on_update hook, which the proxy uses to warm the segments viewers will
+# request next into a SegmentCache.
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from http_encoding import strong_etag
+
+logger = logging.getLogger("mychannel")
+
+_URI_ATTR_RE = re.compile(r'URI="([^"]+)"')
+_PART_TARGET_RE = re.compile(r"PART-TARGET=([0-9.]+)")
+
+
+@dataclass
+class PlaylistState:
+    is_media: bool
+    media_sequence: int
+    last_msn: int  # -1 until the first complete segment
+    next_parts: int  # parts already published for segment last_msn + 1
+    target_duration: float
+    part_target: Optional[float]
+    has_server_control: bool
+
+    def has(self, msn: int, part: Optional[int]) -> bool:
+        """True once this playlist contains segment `msn` (or part `part` of it)."""
+        if not self.is_media or msn <= self.last_msn:
+            return True
+        return part is not None and msn == self.last_msn + 1 and part < self.next_parts
+
+
+def parse_playlist(text: str) -> PlaylistState:
+    media_sequence = 0
+    segments = 0
+    parts_since_segment = 0
+    target_duration = 0.0
+    part_target: Optional[float] = None
+    is_media = False
+    has_server_control = False
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            media_sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            target_duration = float(line.split(":", 1)[1])
+            is_media = True
+        elif line.startswith("#EXT-X-PART-INF:"):
+            m = _PART_TARGET_RE.search(line)
+            part_target = float(m.group(1)) if m else None
+        elif line.startswith("#EXT-X-PART:"):
+            parts_since_segment += 1
+        elif line.startswith("#EXTINF:"):
+            is_media = True
+        elif line.startswith("#EXT-X-SERVER-CONTROL:"):
+            has_server_control = True
+        elif not line.startswith("#") and is_media:
+            # Parts listed before a segment URI belong to that segment
+            segments += 1
+            parts_since_segment = 0
+    return PlaylistState(
+        is_media=is_media,
+        media_sequence=media_sequence,
+        last_msn=media_sequence + segments - 1,
+        next_parts=parts_since_segment,
+        target_duration=target_duration,
+        part_target=part_target,
+        has_server_control=has_server_control,
+    )
+
+
+def rewrite_playlist(text: str, base_dir: str, state: PlaylistState, file_url: str = "/live/file?path=") -> str:
+    """Route every relative URI (plain lines and URI="..." attributes) through /live/file."""
+
+    def proxied(uri: str) -> str:
+        if "://" in uri or uri.startswith("/"):
+            return uri
+        return f"{file_url}{base_dir}{uri}"
+
+    rewritten_lines = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            rewritten_lines.append(raw)
+        elif line.startswith("#"):
+            rewritten_lines.append(_URI_ATTR_RE.sub(lambda m: f'URI="{proxied(m.group(1))}"', raw))
+        else:
+            rewritten_lines.append(proxied(line))
+
+    # Advertise blocking reload when the packager didn't, so players stop timer-polling
+    if state.is_media and not state.has_server_control and rewritten_lines:
+        control = "#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES"
+        if state.part_target:
+            control += f",PART-HOLD-BACK={3 * state.part_target:.3f}"
+        rewritten_lines.insert(1, control)
+    return "\n".join(rewritten_lines) if rewritten_lines else text
+
+
+def upcoming_uris(text: str, state: PlaylistState, segments: int = 3) -> List[str]:
+    """URIs viewers will request next: the newest `segments` segments plus any trailing parts and
+    the init map for media playlists, every variant/rendition playlist for master playlists."""
+    segment_uris: List[str] = []
+    part_uris: List[str] = []
+    map_uris: List[str] = []
+    variant_uris: List[str] = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("#"):
+            m = _URI_ATTR_RE.search(line)
+            if not m:
+                continue
+            if line.startswith("#EXT-X-PART:"):
+                part_uris.append(m.group(1))
+            elif line.startswith("#EXT-X-MAP:"):
+                map_uris.append(m.group(1))
+            elif line.startswith(("#EXT-X-MEDIA:", "#EXT-X-I-FRAME-STREAM-INF:")):
+                variant_uris.append(m.group(1))
+        elif state.is_media:
+            segment_uris.append(line)
+            part_uris = []  # parts of a completed segment are covered by the segment itself
+        else:
+            variant_uris.append(line)
+    if not state.is_media:
+        return variant_uris
+    return map_uris[-1:] + segment_uris[-segments:] + part_uris
+
+
+@dataclass
+class PlaylistVersion:
+    raw: bytes
+    body: str
+    state: PlaylistState
+    fetched_at: float
+    etag: str = ""  # of the rewritten body, computed once per version
+
+
+class BlockingReloadError(ValueError):
+    """The requested _HLS_msn is too far ahead of the live edge (spec: answer 400)."""
+
+
+class PlaylistWatcher:
+    """Coalesces polling of one playlist object and wakes blocked viewers on each new version.
+
+    Only blocking (_HLS_msn) requests start the poll loop, which runs while viewers are blocked
+    and for `idle_timeout` seconds after the last one; plain requests refresh the playlist on
+    demand at most once per interval. `poll_interval` is the floor for the poll interval.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fetch: Callable[[str], Awaitable[bytes]],
+        base_dir: str = "",
+        file_url: str = "/live/file?path=",
+        poll_interval: float = 0.25,
+        idle_timeout: float = 10.0,
+        max_block: float = 12.0,
+        on_update: Optional[Callable[["PlaylistWatcher", "PlaylistVersion"], None]] = None,
+    ):
+        self.path = path
+        self.fetch = fetch
+        self.base_dir = base_dir
+        self.file_url = file_url
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.max_block = max_block
+        self.on_update = on_update
+        self.version: Optional[PlaylistVersion] = None
+        self._cond: Optional[asyncio.Condition] = None
+        self._fetch_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._waiters = 0
+        self._last_access = 0.0
+        self._last_blocked = 0.0
+
+    @property
+    def interval(self) -> float:
+        # Twice per part (or per segment without LL-HLS parts): new content shows up promptly
+        # without reading the origin far more often than the playlist can change
+        state = self.version.state if self.version else None
+        if state and state.part_target:
+            return max(self.poll_interval, state.part_target / 2)
+        if state and state.target_duration:
+            return max(self.poll_interval, state.target_duration / 2)
+        return self.poll_interval
+
+    def _primitives(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+            self._fetch_lock = asyncio.Lock()
+        return self._cond, self._fetch_lock
+
+    async def _refresh(self) -> None:
+        cond, fetch_lock = self._primitives()
+        async with fetch_lock:
+            if self.version and time.monotonic() - self.version.fetched_at < self.interval:
+                return  # another caller refreshed while we waited for the lock
+            data = await self.fetch(self.path)
+            now = time.monotonic()
+            if self.version and data == self.version.raw:
+                self.version.fetched_at = now
+                return
+            text = data.decode("utf-8", errors="ignore")
+            state = parse_playlist(text)
+            body = rewrite_playlist(text, self.base_dir, state, self.file_url)
+            self.version = PlaylistVersion(data, body, state, now, strong_etag(body.encode("utf-8")))
+        async with cond:
+            cond.notify_all()
+        if self.on_update is not None:
+            try:
+                self.on_update(self, self.version)
+            except Exception as e:
+                logger.warning("Playlist update hook failed for %s: %s", self.path, e)
+
+    def _ensure_polling(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._poll())
+
+    async def _poll(self) -> None:
+        while self._waiters > 0 or time.monotonic() - self._last_blocked < self.idle_timeout:
+            try:
+                await self._refresh()
+            except Exception as e:
+                logger.warning("Playlist poll failed for %s: %s", self.path, e)
+            await asyncio.sleep(self.interval)
+
+    def active(self) -> bool:
+        """True while viewers are blocked on this playlist, it is still being polled, or it was
+        requested within the last `idle_timeout` seconds."""
+        if self._waiters > 0 or (self._task is not None and not self._task.done()):
+            return True
+        return time.monotonic() - self._last_access < self.idle_timeout
+
+    async def latest(self) -> PlaylistVersion:
+        """Current playlist, fetched at most once per poll interval across all viewers."""
+        self._last_access = time.monotonic()
+        if self.version is None or time.monotonic() - self.version.fetched_at >= self.interval:
+            await self._refresh()
+        return self.version
+
+    async def wait_for(self, msn: int, part: Optional[int]) -> Optional[PlaylistVersion]:
+        """Block until the playlist contains msn/part; None after three target durations
+        (at most `max_block` seconds, which must stay under the gateway/proxy deadline)."""
+        version = await self.latest()
+        state = version.state
+        if msn > state.last_msn + 2:
+            raise BlockingReloadError(f"_HLS_msn {msn} is beyond the live edge {state.last_msn}")
+        # Blocking viewers come straight back with the next msn, so keep polling between requests
+        self._last_blocked = time.monotonic()
+        self._ensure_polling()
+        if state.has(msn, part):
+            return version
+
+        cond, _ = self._primitives()
+        self._waiters += 1
+        try:
+            async with cond:
+                await asyncio.wait_for(
+                    cond.wait_for(lambda: self.version.state.has(msn, part)),
+                    timeout=min(3 * max(state.target_duration, 1.0), self.max_block),
+                )
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._waiters -= 1
+            self._last_access = self._last_blocked = time.monotonic()
+        return self.version
+
+
+class SegmentCache:
+    """Byte-bounded LRU of segment bodies with single-flight loading.
+
+    Concurrent requests for the same object share one GCS read, whether it was started by a
+    viewer or by the prefetcher. Each cached body keeps its ETag so it is hashed only once.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._etags: Dict[str, str] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def get(self, path: str) -> Optional[bytes]:
+        data = self._items.get(path)
+        if data is not None:
+            self._items.move_to_end(path)
+        return data
+
+    def put(self, path: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        old = self._items.pop(path, None)
+        if old is not None:
+            self.size -= len(old)
+        self._items[path] = data
+        self._etags[path] = strong_etag(data)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            evicted_path, evicted = self._items.popitem(last=False)
+            self._etags.pop(evicted_path, None)
+            self.size -= len(evicted)
+
+    def discard_prefix(self, prefix: str) -> None:
+        """Drop every cached body under `prefix` (a channel that went away)."""
+        for path in [p for p in self._items if p.startswith(prefix)]:
+            self.size -= len(self._items.pop(path))
+            self._etags.pop(path, None)
+
+    def etag(self, path: str, data: bytes) -> str:
+        """ETag of `data` as cached for `path`; hashed on the spot only for uncacheable bodies."""
+        etag = self._etags.get(path)
+        return etag if etag is not None and self._items.get(path) is data else strong_etag(data)
+
+    def pending(self, path: str) -> bool:
+        return path in self._items or path in self._inflight
+
+    async def fetch(self, path: str, loader: Callable[[str], Awaitable[bytes]], count: bool = True) -> bytes:
+        data = self.get(path)
+        if data is not None:
+            self.hits += count
+            return data
+        inflight = self._inflight.get(path)
+        if inflight is not None:
+            self.hits += count
+            return await asyncio.shield(inflight)
+        self.misses += count
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[path] = future
+        try:
+            data = await loader(path)
+            self.put(path, data)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved; joiners re-raise it themselves
+            raise
+        finally:
+            del self._inflight[path]
+
+
+class Prefetcher:
+    """Warms a SegmentCache in the background within a concurrency budget."""
+
+    def __init__(self, cache: SegmentCache, loader: Callable[[str], Awaitable[bytes]], max_concurrency: int = 4):
+        self.cache = cache
+        self.loader = loader
+        self.max_concurrency = max_concurrency
+        self.prefetched = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: set = set()
+
+    def schedule(self, paths: List[str]) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+        for path in paths:
+            if self.cache.pending(path):
+                continue
+            task = loop.create_task(self._prefetch(path))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch(self, path: str) -> None:
+        async with self._semaphore:
+            # A viewer may have fetched it while this task was queued
+            if self.cache.pending(path):
+                return
+            try:
+                await self.cache.fetch(path, self.loader, count=False)
+                self.prefetched += 1
+            except Exception as e:
+                logger.debug("Prefetch of %s failed: %s", path, e)
@@ -1,12 +1,15 @@
 import os
 import time
+import asyncio
 import json
 import uuid
 import logging
+from contextlib import asynccontextmanager
 from typing import Optional, List, Dict, Any
 
-from fastapi import FastAPI, HTTPException, Request, Header, Response
+from fastapi import FastAPI, HTTPException, Request, Header, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field, constr
 from google.cloud import aiplatform, logging as gclogging
 from google.cloud import pubsub_v1
@@ -14,6 +17,11 @@ from google.cloud import bigquery
 from tenacity import retry, wait_exponential_jitter, stop_after_attempt, retry_if_exception_type
 from google.cloud import storage
 from google.cloud import videointelligence_v1 as vi
+from bulkheads import Bulkhead, BulkheadFull, Bulkheads
+from http_encoding import EncodingMiddleware
+from live_channels import ChannelRegistry, FetchScheduler, LiveChannel
+from live_hls import BlockingReloadError, SegmentCache
+from model_registry import ModelRegistry
 try:
     import firebase_admin
     from firebase_admin import auth as fb_auth
@@ -27,6 +35,9 @@ LOCATION = os.environ.get("LOCATION", "us-central1")
 API_KEY = os.environ.get("API_KEY")  # Optional simple API key
 MEDIA_BUCKET = os.environ.get("MEDIA_BUCKET")
 MODEL_NAME = os.environ.get("GEN_MODEL", "gemini-1.5-flash")
+# Comma-separated models tried in order when MODEL_NAME fails (or a request prefers another)
+MODEL_FALLBACKS = [m.strip() for m in os.environ.get("GEN_MODEL_FALLBACKS", "").split(",") if m.strip()]
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "true").lower() == "true"
 MAX_TEXT_CHARS = int(os.environ.get("MAX_TEXT_CHARS", "4000"))
 
 if not PROJECT_ID:
@@ -37,6 +48,7 @@ gclogging.Client().setup_logging()
 aiplatform.init(project=PROJECT_ID, location=LOCATION)
 logger = logging.getLogger("mychannel")
 logger.setLevel(logging.INFO)
+models = ModelRegistry([MODEL_NAME] + MODEL_FALLBACKS)
 
 # Initialize Firebase Admin if available
 if firebase_admin and not getattr(firebase_admin, "_apps", {}):  # type: ignore[attr-defined]
@@ -56,8 +68,29 @@ try:
 except Exception as e:
     logger.warning("Pub/Sub publisher init failed: %s", e)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop = asyncio.get_running_loop()
+    # Model warmup runs in the background so the port opens at once; /readyz answers 503 until
+    # it finishes
+    warmup: Optional[asyncio.Task] = None
+    if MODEL_WARMUP:
+        warmup = loop.create_task(bulkheads["interactive_ai"].run(models.warmup))
+        warmup.add_done_callback(lambda t: t.cancelled() or t.exception())
+    # Release idle live channels and playlist watchers even when no new channel is being created
+    pruning = loop.create_task(live_channels.prune_periodically(LIVE_PRUNE_INTERVAL))
+    try:
+        yield
+    finally:
+        # Stop the background tasks before the pools they run on
+        pruning.cancel()
+        if warmup is not None:
+            warmup.cancel()
+        bulkheads.shutdown()
+
+
 # App
-app = FastAPI(title="MyChannel AI", version="1.0.0")
+app = FastAPI(title="MyChannel AI", version="1.0.0", lifespan=lifespan)
 
 # CORS (tighten origins in prod)
 app.add_middleware(
@@ -66,13 +99,37 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["POST", "GET", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# gzip/brotli for text payloads above COMPRESS_MIN_BYTES; strong ETags + 304 on If-None-Match
+app.add_middleware(EncodingMiddleware)
+
+# Bulkheads: blocking work runs on a pool per route class instead of the shared threadpool,
+# so queued video analyses cannot delay health probes or live segments. Override sizes with
+# BULKHEAD_<NAME>_WORKERS/_QUEUE/_TIMEOUT; full or timed-out queues answer 503 + Retry-After.
+bulkheads = Bulkheads(
+    Bulkhead.from_env("live", workers=32, queue_size=256, queue_timeout=5.0),
+    Bulkhead.from_env("interactive_ai", workers=16, queue_size=64, queue_timeout=10.0),
+    Bulkhead.from_env("long_ai", workers=8, queue_size=16, queue_timeout=2.0),
+)
+
+
+@app.exception_handler(BulkheadFull)
+async def bulkhead_full_handler(request: Request, exc: BulkheadFull):
+    logger.warning("Rejected %s %s: %s", request.method, request.url.path, exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, int(exc.retry_after)))},
+    )
+
 
 # Models
 class SummarizeRequest(BaseModel):
     text: constr(strip_whitespace=True, min_length=1) = Field(..., description="Text to summarize")
     lang: Optional[str] = Field(default="en", description="Language code")
+    model: Optional[str] = Field(default=None, description="Preferred configured model; the others remain fallbacks")
 
 
 class SummarizeResponse(BaseModel):
@@ -87,6 +144,7 @@ class HealthResponse(BaseModel):
     project: str
     location: str
     model: str
+    models: Optional[Dict[str, Any]] = None
 
 
 # Helpers
@@ -154,9 +212,9 @@ def publish_video_features(event: Dict[str, Any]) -> None:
         logger.warning("Pub/Sub video-features publish failed: %s", e)
 
 
-def get_model():
-    from vertexai.generative_models import GenerativeModel
-    return GenerativeModel(MODEL_NAME)
+def get_model(name: Optional[str] = None):
+    # Shared per-process instance; retries and concurrent requests reuse the same client
+    return models.get(name)
 
 
 @retry(
@@ -165,8 +223,8 @@ def get_model():
     retry=retry_if_exception_type(Exception),
     reraise=True,
 )
-def generate_summary_sync(prompt: str) -> str:
-    model = get_model()
+def generate_summary_sync(prompt: str, model_name: str = MODEL_NAME) -> str:
+    model = get_model(model_name)
     resp = model.generate_content(prompt)
     # Vertex responses may contain safety blocks; guard for text
     text = getattr(resp, "text", None)
@@ -179,6 +237,21 @@ def generate_summary_sync(prompt: str) -> str:
     return text
 
 
+def summarize_with_fallback(prompt: str, preferred: Optional[str] = None) -> tuple:
+    """Try each routed model (with its retries) in turn; returns (text, model used)."""
+    last_error: Optional[Exception] = None
+    for name in models.route(preferred):
+        try:
+            text = generate_summary_sync(prompt, name)
+        except Exception as e:
+            logger.warning("Model %s failed, trying next fallback: %s", name, e)
+            last_error = e
+            continue
+        models.mark_warm(name)
+        return text, name
+    raise last_error
+
+
 # Video Intelligence API request/response
 class AnalyzeVideoRequest(BaseModel):
     gcs_uri: constr(strip_whitespace=True, min_length=10)
@@ -197,6 +270,7 @@ class AnalyzeVideoResponse(BaseModel):
 
 
 @app.post("/ai/analyzeVideo", response_model=AnalyzeVideoResponse)
+@bulkheads.isolate("long_ai")
 def analyze_video(req: AnalyzeVideoRequest, x_api_key: Optional[str] = Header(default=None), authorization: Optional[str] = Header(default=None)):
     _ = require_auth(x_api_key, authorization)
     client = vi.VideoIntelligenceServiceClient()
@@ -285,6 +359,7 @@ class ScoreViralityResponse(BaseModel):
 
 
 @app.post("/ai/scoreVirality", response_model=ScoreViralityResponse)
+@bulkheads.isolate("interactive_ai")
 def score_virality(req: ScoreViralityRequest, x_api_key: Optional[str] = Header(default=None), authorization: Optional[str] = Header(default=None)):
     _ = require_auth(x_api_key, authorization)
 
@@ -329,28 +404,46 @@ def score_virality(req: ScoreViralityRequest, x_api_key: Optional[str] = Header(
 
 # Routes
 @app.get("/", response_model=HealthResponse)
-def root():
+async def root():
     return HealthResponse(status="ok", project=PROJECT_ID, location=LOCATION, model=MODEL_NAME)
 
 
 @app.get("/healthz", response_model=HealthResponse)
-def healthz():
+async def healthz():
+    # No blocking work, so liveness never waits on any pool
     return HealthResponse(status="ok", project=PROJECT_ID, location=LOCATION, model=MODEL_NAME)
 
 
 @app.get("/readyz", response_model=HealthResponse)
-def readyz():
-    # Lightweight readiness: verify we can instantiate the model
-    _ = get_model()
-    return HealthResponse(status="ready", project=PROJECT_ID, location=LOCATION, model=MODEL_NAME)
+async def readyz(response: Response):
+    # Reports registry state only: never builds a model or opens a connection
+    if models.warm[models.primary]:
+        status = "ready"
+    elif MODEL_WARMUP and (models.warming or models.warmed_at is None):
+        status = "warming"
+        response.status_code = 503
+    else:
+        status = "cold"  # warmup disabled or failed; the first request pays channel setup
+    return HealthResponse(status=status, project=PROJECT_ID, location=LOCATION, model=MODEL_NAME,
+                          models=models.status())
+
+
+@app.get("/metrics/bulkheads")
+def bulkhead_metrics(x_api_key: Optional[str] = Header(default=None), authorization: Optional[str] = Header(default=None)):
+    # Per-pool saturation: active/workers, queue depth, rejections and recent queue wait
+    _ = require_auth(x_api_key, authorization)
+    return {"bulkheads": bulkheads.stats(), "live_fetch": fetch_scheduler.stats()}
 
 
 @app.post("/ai/summarize", response_model=SummarizeResponse)
+@bulkheads.isolate("interactive_ai")
 def summarize(req: SummarizeRequest, request: Request, x_api_key: Optional[str] = Header(default=None), authorization: Optional[str] = Header(default=None)):
     _ = require_auth(x_api_key, authorization)
 
     if len(req.text) > MAX_TEXT_CHARS:
         raise HTTPException(status_code=413, detail=f"text too long; max {MAX_TEXT_CHARS} chars")
+    if req.model and req.model not in models.names:
+        raise HTTPException(status_code=400, detail=f"unknown model; configured: {', '.join(models.names)}")
 
     cid = client_id_from_request(request)
     req_id = str(uuid.uuid4())
@@ -359,7 +452,7 @@ def summarize(req: SummarizeRequest, request: Request, x_api_key: Optional[str]
     prompt = f"Summarize the following for a concise, engaging video description in {req.lang}:\n\n{req.text}"
 
     try:
-        summary = generate_summary_sync(prompt)
+        summary, model_used = summarize_with_fallback(prompt, req.model)
         latency_ms = int((time.time() - start) * 1000)
 
         log = {
@@ -367,7 +460,7 @@ def summarize(req: SummarizeRequest, request: Request, x_api_key: Optional[str]
             "message": "summarize_ok",
             "request_id": req_id,
             "client_id": cid,
-            "model": MODEL_NAME,
+            "model": model_used,
             "lang": req.lang or "en",
             "text_len": len(req.text),
             "latency_ms": latency_ms,
@@ -375,7 +468,7 @@ def summarize(req: SummarizeRequest, request: Request, x_api_key: Optional[str]
         logger.info(json.dumps(log))
         pubsub_event({"type": "summarize", "ok": True, **log})
 
-        return SummarizeResponse(summary=summary, id=req_id, model=MODEL_NAME, latency_ms=latency_ms)
+        return SummarizeResponse(summary=summary, id=req_id, model=model_used, latency_ms=latency_ms)
     except Exception as e:
         latency_ms = int((time.time() - start) * 1000)
         err = {
@@ -383,7 +476,7 @@ def summarize(req: SummarizeRequest, request: Request, x_api_key: Optional[str]
             "message": "summarize_fail",
             "request_id": req_id,
             "client_id": cid,
-            "model": MODEL_NAME,
+            "model": req.model or MODEL_NAME,
             "lang": req.lang or "en",
             "text_len": len(req.text),
             "latency_ms": latency_ms,
@@ -395,56 +488,124 @@ def summarize(req: SummarizeRequest, request: Request, x_api_key: Optional[str]
 
 
 # Live HLS proxy endpoints (serve GCS HLS via Cloud Run/API Gateway)
+# Channel "default" keeps the original single-channel layout; any other channel id reads from
+# LIVE_CHANNEL_PREFIX with {channel} substituted.
+LIVE_DEFAULT_CHANNEL = "default"
+LIVE_PREFIX = "livestream/outputs/"
+LIVE_CHANNEL_PREFIX = os.environ.get("LIVE_CHANNEL_PREFIX", "livestream/{channel}/outputs/")
+LIVE_MAX_CHANNELS = int(os.environ.get("LIVE_MAX_CHANNELS", "64"))
+LIVE_CHANNEL_IDLE_TTL = float(os.environ.get("LIVE_CHANNEL_IDLE_TTL", "600"))
+LIVE_FETCH_CONCURRENCY = int(os.environ.get("LIVE_FETCH_CONCURRENCY", "32"))
+LIVE_FETCH_PER_CHANNEL = int(os.environ.get("LIVE_FETCH_PER_CHANNEL", "6"))
+# Floor for playlist polling; the actual interval is half the part (or segment) target
+LIVE_POLL_INTERVAL = float(os.environ.get("LIVE_POLL_INTERVAL", "0.25"))
+# Longest a blocking playlist reload is held; keep it under the API Gateway deadline for
+# /live/playlist (15 s in infra/terraform/openapi.tmpl.yaml)
+LIVE_MAX_BLOCK_SECONDS = float(os.environ.get("LIVE_MAX_BLOCK_SECONDS", "12"))
+LIVE_STATUS_TTL = float(os.environ.get("LIVE_STATUS_TTL", "5"))
+# One segment budget shared by all channels; keep well under the instance memory (512Mi by default)
+LIVE_PREFETCH_BYTES = int(os.environ.get("LIVE_PREFETCH_BYTES", str(96 * 1024 * 1024)))
+LIVE_PRUNE_INTERVAL = float(os.environ.get("LIVE_PRUNE_INTERVAL", "60"))
+LIVE_PREFETCH_CONCURRENCY = int(os.environ.get("LIVE_PREFETCH_CONCURRENCY", "2"))
+LIVE_PREFETCH_SEGMENTS = int(os.environ.get("LIVE_PREFETCH_SEGMENTS", "3"))
+_storage_client: Optional[storage.Client] = None
+
+
+def get_storage_client() -> storage.Client:
+    global _storage_client
+    if _storage_client is None:
+        _storage_client = storage.Client(project=PROJECT_ID)
+    return _storage_client
+
+
 def _gcs_read_bytes(path: str) -> bytes:
     if not MEDIA_BUCKET:
         raise HTTPException(status_code=500, detail="MEDIA_BUCKET not configured")
-    client = storage.Client(project=PROJECT_ID)
-    bucket = client.bucket(MEDIA_BUCKET)
+    bucket = get_storage_client().bucket(MEDIA_BUCKET)
     blob = bucket.blob(path)
     if not blob.exists():
         raise HTTPException(status_code=404, detail="Not found")
     return blob.download_as_bytes()
 
 
-@app.get("/live/playlist")
-def live_playlist():
-    # Default location used by Live Stream channel config
-    manifest_path = "livestream/outputs/manifest.m3u8"
+def _new_channel(channel_id: str) -> LiveChannel:
+    if channel_id == LIVE_DEFAULT_CHANNEL:
+        prefix, file_url = LIVE_PREFIX, "/live/file?path="
+    else:
+        prefix, file_url = LIVE_CHANNEL_PREFIX.format(channel=channel_id), f"/live/file?channel={channel_id}&path="
+    return LiveChannel(
+        channel_id,
+        prefix,
+        fetch_scheduler,
+        _gcs_read_bytes,
+        file_url,
+        segment_cache,
+        poll_interval=LIVE_POLL_INTERVAL,
+        max_block=LIVE_MAX_BLOCK_SECONDS,
+        prefetch_concurrency=LIVE_PREFETCH_CONCURRENCY,
+        prefetch_segments=LIVE_PREFETCH_SEGMENTS,
+    )
+
+
+segment_cache = SegmentCache(LIVE_PREFETCH_BYTES)
+fetch_scheduler = FetchScheduler(LIVE_FETCH_CONCURRENCY, LIVE_FETCH_PER_CHANNEL, run_blocking=bulkheads["live"].run)
+live_channels = ChannelRegistry(_new_channel, max_channels=LIVE_MAX_CHANNELS, idle_ttl=LIVE_CHANNEL_IDLE_TTL)
+
+
+def get_channel(channel_id: str) -> LiveChannel:
     try:
-        data = _gcs_read_bytes(manifest_path)
-    except HTTPException as e:
-        raise e
-    # Optionally rewrite URIs to route segment requests through /live/segment
-    text = data.decode("utf-8", errors="ignore")
-    rewritten_lines = []
-    for raw in text.splitlines():
-        line = raw.strip()
-        if not line or line.startswith("#"):
-            rewritten_lines.append(raw)
-            continue
-        # Rewrite any URI line to route through proxy
-        rewritten_lines.append(f"/live/file?path={line}")
-    out = "\n".join(rewritten_lines) if rewritten_lines else text
-    return Response(content=out, media_type="application/vnd.apple.mpegurl")
+        return live_channels.get(channel_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid channel")
+    except LookupError:
+        raise HTTPException(status_code=503, detail="too many active channels")
+
+
+async def serve_playlist(
+    channel: LiveChannel, relative_path: str, hls_msn: Optional[int], hls_part: Optional[int]
+) -> Response:
+    """Serve a rewritten playlist, holding LL-HLS blocking reloads until the requested msn/part exists."""
+    if hls_part is not None and hls_msn is None:
+        raise HTTPException(status_code=400, detail="_HLS_part requires _HLS_msn")
+    try:
+        version = await channel.playlist(relative_path, hls_msn, hls_part)
+    except BlockingReloadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if version is None:
+        raise HTTPException(status_code=503, detail="playlist update timed out")
+    return Response(content=version.body, media_type="application/vnd.apple.mpegurl", headers={"ETag": version.etag})
+
+
+@app.get("/live/playlist")
+async def live_playlist(
+    channel: str = Query(default=LIVE_DEFAULT_CHANNEL),
+    hls_msn: Optional[int] = Query(default=None, alias="_HLS_msn"),
+    hls_part: Optional[int] = Query(default=None, alias="_HLS_part"),
+):
+    # Default location used by Live Stream channel config; URIs are rewritten to route through /live/file
+    return await serve_playlist(get_channel(channel), "manifest.m3u8", hls_msn, hls_part)
 
 
 @app.get("/live/file")
-def live_file(path: str):
+async def live_file(
+    path: str,
+    channel: str = Query(default=LIVE_DEFAULT_CHANNEL),
+    hls_msn: Optional[int] = Query(default=None, alias="_HLS_msn"),
+    hls_part: Optional[int] = Query(default=None, alias="_HLS_part"),
+):
     if ".." in path or path.startswith("/"):
         raise HTTPException(status_code=400, detail="invalid path")
-    # Serve any file (segments, sub-playlists, init mp4) under output prefix
-    path = f"livestream/outputs/{path}"
-    try:
-        data = _gcs_read_bytes(path)
-    except HTTPException as e:
-        raise e
-    content_type = "application/octet-stream"
+    live = get_channel(channel)
     lower = path.lower()
     if lower.endswith(".m3u8"):
-        content_type = "application/vnd.apple.mpegurl"
-    elif lower.endswith(".m4s") or lower.endswith(".mp4"):
+        # Sub-playlists share the watcher path so they support blocking reload too
+        return await serve_playlist(live, path, hls_msn, hls_part)
+    # Serve any file (segments, init mp4) under the channel prefix; usually already prefetched
+    data, etag = await live.segment(path)
+    content_type = "application/octet-stream"
+    if lower.endswith(".m4s") or lower.endswith(".mp4"):
         content_type = "video/mp4"
-    return Response(content=data, media_type=content_type)
+    return Response(content=data, media_type=content_type, headers={"ETag": etag})
 
 
 class LiveStatusResponse(BaseModel):
@@ -454,13 +615,11 @@ class LiveStatusResponse(BaseModel):
     latest_updated: Optional[str] = None
 
 
-@app.get("/live/status", response_model=LiveStatusResponse)
-def live_status():
+def _compute_live_status(prefix: str) -> LiveStatusResponse:
     if not MEDIA_BUCKET:
         raise HTTPException(status_code=500, detail="MEDIA_BUCKET not configured")
-    client = storage.Client(project=PROJECT_ID)
+    client = get_storage_client()
     bucket = client.bucket(MEDIA_BUCKET)
-    prefix = "livestream/outputs/"
     # List a small set of blobs under the HLS output prefix
     blobs = list(client.list_blobs(bucket, prefix=prefix, max_results=50))
     if not blobs:
@@ -479,4 +638,10 @@ def live_status():
         has_recent_segments=has_recent,
         latest_object=latest.name,
         latest_updated=latest_time.isoformat() if latest_time else None,
-    )
\ No newline at end of file
+    )
+
+
+@app.get("/live/status", response_model=LiveStatusResponse)
+async def live_status(channel: str = Query(default=LIVE_DEFAULT_CHANNEL)):
+    # Cached per channel so status polling from many players costs one listing per TTL
+    return await get_channel(channel).cached_status(_compute_live_status, LIVE_STATUS_TTL)
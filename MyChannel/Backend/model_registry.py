@@ -0,0 +1,83 @@
+# Per-process Vertex model registry: every configured model is built once and reused by all
+# requests and retries, and a startup warmup pays for channel setup before real traffic does.
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("mychannel")
+
+
+def _vertex_model(name: str) -> Any:
+    from vertexai.generative_models import GenerativeModel
+    return GenerativeModel(name)
+
+
+class ModelRegistry:
+    """Configured generative models, primary first, then fallbacks in order."""
+
+    def __init__(self, names: List[str], factory: Callable[[str], Any] = _vertex_model):
+        if not names:
+            raise ValueError("at least one model name is required")
+        self.names = list(dict.fromkeys(names))
+        self.factory = factory
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.warm: Dict[str, bool] = {name: False for name in self.names}
+        self.errors: Dict[str, str] = {}
+        self.warming = False
+        self.warmed_at: Optional[float] = None
+
+    @property
+    def primary(self) -> str:
+        return self.names[0]
+
+    def get(self, name: Optional[str] = None) -> Any:
+        """The shared instance for `name` (default: primary), built on first use."""
+        name = name or self.primary
+        if name not in self.warm:
+            raise KeyError(f"model {name!r} is not configured")
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = self._models[name] = self.factory(name)
+        return model
+
+    def route(self, preferred: Optional[str] = None) -> List[str]:
+        """Model names to try for a request: `preferred` (if configured), then the rest in order."""
+        if preferred and preferred in self.warm:
+            return [preferred] + [n for n in self.names if n != preferred]
+        return list(self.names)
+
+    def mark_warm(self, name: str) -> None:
+        """Record a successful generation (real traffic warms a model as well as the warmup)."""
+        self.warm[name] = True
+        self.errors.pop(name, None)
+
+    def warmup(self, prompt: str = "Reply with OK.") -> bool:
+        """One tiny generation per model, primary first; True once the primary is warm."""
+        self.warming = True
+        try:
+            for name in self.names:
+                started = time.perf_counter()
+                try:
+                    self.get(name).generate_content(prompt, generation_config={"max_output_tokens": 1})
+                except Exception as e:
+                    self.errors[name] = str(e)
+                    logger.warning("Warmup of model %s failed: %s", name, e)
+                    continue
+                self.mark_warm(name)
+                logger.info("Warmed model %s in %.0f ms", name, (time.perf_counter() - started) * 1000)
+        finally:
+            self.warming = False
+            self.warmed_at = time.time()
+        return self.warm[self.primary]
+
+    def status(self) -> Dict[str, Any]:
+        """Warm/cold state per model; never builds a model or opens a connection."""
+        return {
+            name: {"built": name in self._models, "warm": self.warm[name], "error": self.errors.get(name)}
+            for name in self.names
+        }
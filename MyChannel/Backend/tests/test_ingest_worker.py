@@ -0,0 +1,117 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import ingest_worker
+
+
+class FakeMessage:
+    def __init__(self, dispatcher, n):
+        self.dispatcher = dispatcher
+        self.message_id = str(n)
+        self.data = json.dumps({"video_id": f"v{n}", "ingested_at": 1700000000 + n, "labels": ["a"]}).encode()
+
+    def ack(self):
+        self.dispatcher.settle(self, "acked")
+
+    def nack(self):
+        self.dispatcher.settle(self, "nacked")
+
+
+class FakeStreamingPull:
+    """Delivers messages from a thread; like google-cloud-pubsub 2.x, acks and nacks only queue on
+    the dispatcher, so any settled after cancel() never reach the server."""
+
+    def __init__(self, callback, count):
+        self.callback = callback
+        self.count = count
+        self.acked, self.nacked, self.dropped = set(), set(), set()
+        self.delivered = threading.Event()
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._deliver, daemon=True)
+        self._thread.start()
+
+    def _deliver(self):
+        for n in range(self.count):
+            self.callback(FakeMessage(self, n))
+        self.delivered.set()
+        self._cancelled.wait()
+
+    def settle(self, message, outcome):
+        with self._lock:
+            if self._cancelled.is_set():
+                self.dropped.add(message.message_id)
+            else:
+                getattr(self, outcome).add(message.message_id)
+
+    # StreamingPullFuture
+    def cancel(self):
+        self._cancelled.set()
+
+    def done(self):
+        return self._cancelled.is_set()
+
+    def result(self, timeout=None):
+        self._thread.join(timeout)
+
+
+@pytest.fixture
+def fake_pubsub(monkeypatch):
+    pulls = []
+
+    class SubscriberClient:
+        def subscription_path(self, project, subscription):
+            return f"projects/{project}/subscriptions/{subscription}"
+
+        def subscribe(self, path, callback, flow_control):
+            pulls.append(FakeStreamingPull(callback, count=250))
+            return pulls[-1]
+
+        def close(self):
+            pass
+
+    module = types.SimpleNamespace(
+        SubscriberClient=SubscriberClient,
+        types=types.SimpleNamespace(FlowControl=lambda **kwargs: kwargs),
+    )
+    import google.cloud
+
+    monkeypatch.setattr(google.cloud, "pubsub_v1", module, raising=False)
+    monkeypatch.setitem(sys.modules, "google.cloud.pubsub_v1", module)
+    # run_worker installs its own SIGINT/SIGTERM handlers
+    previous = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    yield pulls
+    for sig, handler in previous.items():
+        signal.signal(sig, handler)
+
+
+def test_sigterm_mid_batch_acks_every_committed_message(fake_pubsub):
+    sink = ingest_worker.SqliteSink(":memory:")
+    written = []
+    write = sink.write
+    sink.write = lambda rows: (written.extend(rows), write(rows))
+    sink.close = lambda: None
+    # Nothing is due on its own: the open batch is only committed by the shutdown
+    batcher = ingest_worker.MicroBatcher(sink, max_rows=10_000, max_seconds=3600)
+
+    def terminate():
+        while not fake_pubsub:
+            time.sleep(0.01)
+        fake_pubsub[0].delivered.wait(10)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    threading.Thread(target=terminate, daemon=True).start()
+    ingest_worker.run_worker("demo", "video-features-ingest", batcher, max_messages=1000, max_bytes=1 << 20)
+
+    pull = fake_pubsub[0]
+    assert len(written) == 250
+    assert pull.dropped == set()
+    assert pull.acked == {str(n) for n in range(250)}
+    assert batcher.stats.as_dict()["committed"] == 250
@@ -50,6 +50,12 @@ variable "public_bucket_name" {
   description = "Bucket for public HLS/MPD outputs"
 }
 
+variable "features_ingest_worker" {
+  type        = bool
+  default     = false
+  description = "Drain video features with Backend/ingest_worker.py instead of the BigQuery subscription; enable only once the worker is deployed"
+}
+
 resource "google_project_service" "services" {
   for_each = toset([
     "run.googleapis.com",
@@ -383,8 +389,9 @@ resource "google_pubsub_subscription" "events_bq" {
   }
 }
 
-# Pub/Sub subscription that writes video features into BigQuery table
+# Pub/Sub subscription that writes video features into BigQuery table (until the ingest worker runs)
 resource "google_pubsub_subscription" "video_features_bq" {
+  count = var.features_ingest_worker ? 0 : 1
   name  = "video-features-bq"
   topic = google_pubsub_topic.video_features.name
 
@@ -395,6 +402,42 @@ resource "google_pubsub_subscription" "video_features_bq" {
   }
 }
 
+moved {
+  from = google_pubsub_subscription.video_features_bq
+  to   = google_pubsub_subscription.video_features_bq[0]
+}
+
+# Pull subscription drained by Backend/ingest_worker.py, which de-duplicates and batches
+# video features into BigQuery load jobs. Only one of the two subscriptions exists at a time,
+# so rows are never written twice.
+resource "google_pubsub_subscription" "video_features_ingest" {
+  count                = var.features_ingest_worker ? 1 : 0
+  name                 = "video-features-ingest"
+  topic                = google_pubsub_topic.video_features.name
+  ack_deadline_seconds = 60
+
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
+}
+
+# The ingest worker runs as run-svc: it pulls from its own subscription and runs load jobs.
+# Granted only while the worker is enabled.
+resource "google_pubsub_subscription_iam_member" "ingest_subscriber" {
+  count        = var.features_ingest_worker ? 1 : 0
+  subscription = google_pubsub_subscription.video_features_ingest[0].name
+  role         = "roles/pubsub.subscriber"
+  member       = "serviceAccount:${data.google_service_account.run_svc.email}"
+}
+
+resource "google_project_iam_member" "ingest_job_user" {
+  count   = var.features_ingest_worker ? 1 : 0
+  project = var.project_id
+  role    = "roles/bigquery.jobUser"
+  member  = "serviceAccount:${data.google_service_account.run_svc.email}"
+}
+
 # Allow Pub/Sub service agent to write into BigQuery dataset
 resource "google_bigquery_dataset_iam_member" "pubsub_bq_writer" {
   dataset_id = google_bigquery_dataset.analytics.dataset_id
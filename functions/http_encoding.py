@@ -0,0 +1,123 @@
+# Content negotiation helpers for JSON HTTPS functions: gzip/brotli + strong ETags
+import gzip
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+# --- Shared with functions/ and MyChannel/Backend/ http_encoding.py: keep this section identical ---
+try:
+    # Brotli is optional; gzip is always available
+    import brotli
+except Exception:  # pragma: no cover - optional
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+_ENCODING_SUFFIX = {"br": "-br", "gzip": "-gzip"}
+
+
+def strong_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _base_tag(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in _ENCODING_SUFFIX.values():
+        if tag.endswith(suffix + '"'):
+            return tag[: -len(suffix) - 1] + '"'
+    return tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison; encoding suffixes are ignored so any representation matches."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    base = _base_tag(etag)
+    return any(_base_tag(candidate) == base for candidate in if_none_match.split(","))
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the acceptable encoding with the highest q-value (br on a tie); None means identity."""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    star = weights.get("*", 0.0)
+    best: Optional[str] = None
+    best_q = 0.0
+    for name in ("br", "gzip"):
+        if name == "br" and brotli is None:
+            continue
+        q = weights.get(name, star)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def variant_etag(etag: str, encoding: Optional[str]) -> str:
+    """The ETag of `encoding`'s representation (the base tag for identity)."""
+    return etag[:-1] + _ENCODING_SUFFIX[encoding] + '"' if encoding else etag
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        # Quality 5 keeps dynamic compression cheap while still beating gzip
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+# --- End of shared section ---
+
+
+def canonical_json(payload: Any) -> bytes:
+    """Normalized JSON bytes: sorted keys, compact separators, UTF-8."""
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def encode_body(
+    request_headers: Any,
+    method: str,
+    body: bytes,
+    status: int = 200,
+    headers: Optional[Dict[str, str]] = None,
+    etag: Optional[str] = None,
+    min_bytes: int = COMPRESS_MIN_BYTES,
+) -> Tuple[bytes, int, Dict[str, str]]:
+    """Apply conditional-request and compression rules to an encoded body.
+
+    Returns (body, status, headers); a matching If-None-Match on GET/HEAD yields an empty 304.
+    """
+    out_headers = dict(headers or {})
+    out_headers["Vary"] = "Accept-Encoding"
+    encoding = negotiate_encoding(request_headers.get("Accept-Encoding")) if len(body) >= min_bytes else None
+    if status == 200 and method in ("GET", "HEAD"):
+        # The 304 names the same representation (and varies the same way) as the 200 would
+        etag = variant_etag(etag or strong_etag(body), encoding)
+        out_headers["ETag"] = etag
+        if etag_matches(request_headers.get("If-None-Match"), etag):
+            return b"", 304, out_headers
+
+    if encoding:
+        body = compress(body, encoding)
+        out_headers["Content-Encoding"] = encoding
+    return body, status, out_headers
+
+
+def encode_json(req: Any, payload: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> Tuple[bytes, int, Dict[str, str]]:
+    """Serialize payload once (normalized), then ETag/compress it for this request."""
+    out_headers = {"Content-Type": "application/json", **(headers or {})}
+    return encode_body(req.headers, req.method, canonical_json(payload), status=status, headers=out_headers)
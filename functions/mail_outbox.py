@@ -0,0 +1,191 @@
+# Firestore-backed mail outbox: triggers enqueue rendered messages, a scheduled drain sends them in batches
+# within a per-run time budget
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List
+
+from firebase_admin import firestore
+
+from mail_sender import NOT_ATTEMPTED
+
+OUTBOX_COLLECTION = 'mail_outbox'
+MAX_ATTEMPTS = 5
+# Transient failures wait 2, 4, 8, 16 ... minutes (capped) before the next attempt, so an SMTP
+# outage spreads MAX_ATTEMPTS over about half an hour instead of burning them in minutes
+RETRY_BASE_SECONDS = 120.0
+RETRY_MAX_SECONDS = 3600.0
+
+
+def outbox_id(kind: str, user_id: str) -> str:
+    """Deterministic id: one message per (kind, user), so re-enqueueing is a no-op."""
+    return f"{kind}-{user_id}"
+
+
+def outbox_message(kind: str, user_id: str, to: str, subject: str, html: str, language: str) -> Dict[str, Any]:
+    return {
+        'kind': kind,
+        'user_id': user_id,
+        'to': to,
+        'subject': subject,
+        'html': html,
+        'language': language,
+        'status': 'pending',
+        'attempts': 0,
+        'created_at': firestore.SERVER_TIMESTAMP,
+        'next_attempt_at': firestore.SERVER_TIMESTAMP,
+    }
+
+
+def retry_at(attempts: int) -> datetime:
+    """When a message that has failed `attempts` times may be tried again (exponential backoff)."""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return datetime.now(timezone.utc) + timedelta(seconds=delay)
+
+
+def enqueue(db, message: Dict[str, Any]) -> bool:
+    """Create the outbox document; returns False if this message was already queued."""
+    from google.api_core.exceptions import AlreadyExists
+
+    ref = db.collection(OUTBOX_COLLECTION).document(outbox_id(message['kind'], message['user_id']))
+    try:
+        ref.create(message)
+        return True
+    except AlreadyExists:
+        return False
+
+
+def _claim(db, snaps: List[Any]) -> List[Any]:
+    """Mark pending messages as sending; a concurrent drain that got there first wins the precondition."""
+    from google.api_core.exceptions import FailedPrecondition
+
+    claimed = []
+    batch = db.batch()
+    for snap in snaps:
+        batch.update(snap.reference, {'status': 'sending', 'claimed_at': firestore.SERVER_TIMESTAMP},
+                     option=db.write_option(last_update_time=snap.update_time))
+    try:
+        batch.commit()
+        claimed = snaps
+    except FailedPrecondition:
+        # Someone else claimed part of the page; fall back to per-document claims
+        for snap in snaps:
+            try:
+                snap.reference.update({'status': 'sending', 'claimed_at': firestore.SERVER_TIMESTAMP},
+                                      option=db.write_option(last_update_time=snap.update_time))
+                claimed.append(snap)
+            except FailedPrecondition:
+                continue
+    return claimed
+
+
+def requeue_stale(db, lease_seconds: float, limit: int = 500) -> int:
+    """Return messages stuck in `sending` (a drain died mid-batch) to `pending` once their lease expires.
+
+    Filters claimed_at client-side so the query needs no composite index; the precondition
+    keeps a drain that is still working on a message from having it re-queued underneath it.
+    """
+    from google.api_core.exceptions import FailedPrecondition
+
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=lease_seconds)
+    requeued = 0
+    for snap in db.collection(OUTBOX_COLLECTION).where('status', '==', 'sending').limit(limit).stream():
+        claimed_at = (snap.to_dict() or {}).get('claimed_at')
+        if claimed_at is not None and claimed_at > cutoff:
+            continue
+        try:
+            snap.reference.update({'status': 'pending'}, option=db.write_option(last_update_time=snap.update_time))
+            requeued += 1
+        except FailedPrecondition:
+            continue
+    if requeued:
+        logging.warning(f"Re-queued {requeued} outbox messages whose sending lease expired")
+    return requeued
+
+
+def _record(db, sender, chunk: List[Any], stats: Dict[str, int], deadline: float) -> None:
+    """Build, send and record one chunk; outcomes are committed before the next chunk starts.
+
+    Sends stop at `deadline`; messages that never got an attempt go back to pending untouched.
+    """
+    writer = db.bulk_writer()
+    messages = []
+    for snap in chunk:
+        data = snap.to_dict() or {}
+        try:
+            messages.append((snap.id, sender.build(data['to'], data['subject'], data['html'])))
+        except Exception as e:
+            # A malformed address or body will never send; fail just this message
+            writer.update(snap.reference, {'status': 'failed', 'last_error': f"build: {e}"})
+            stats['failed'] += 1
+            logging.warning(f"Outbox message {snap.id} could not be built: {e}")
+
+    by_id = {snap.id: snap for snap in chunk}
+    for msg_id, error in sender.send_batch(messages, deadline=deadline):
+        ref = by_id[msg_id].reference
+        if error is None:
+            writer.update(ref, {'status': 'sent', 'sent_at': firestore.SERVER_TIMESTAMP})
+            stats['sent'] += 1
+            continue
+        if error == NOT_ATTEMPTED:
+            writer.update(ref, {'status': 'pending'})
+            stats['released'] += 1
+            continue
+        attempts = int((by_id[msg_id].to_dict() or {}).get('attempts', 0)) + 1
+        if attempts >= MAX_ATTEMPTS:
+            status = 'failed'
+            writer.update(ref, {'status': status, 'attempts': attempts, 'last_error': error})
+        else:
+            status = 'pending'
+            writer.update(ref, {'status': status, 'attempts': attempts, 'last_error': error,
+                                'next_attempt_at': retry_at(attempts)})
+        stats['failed' if status == 'failed' else 'retry'] += 1
+        logging.warning(f"Outbox message {msg_id} not sent ({attempts}/{MAX_ATTEMPTS}): {error}")
+    writer.close()
+
+
+def drain_outbox(
+    db,
+    sender,
+    batch_size: int = 200,
+    time_budget: float = 45.0,
+    chunk_size: int = 20,
+    lease_seconds: float = 600.0,
+) -> Dict[str, int]:
+    """Send pending outbox messages until the queue is empty or `time_budget` seconds have passed.
+
+    Each batch claims only what the sender's rate limit can deliver in the remaining budget,
+    and outcomes are written every `chunk_size` messages. The deadline also reaches each send
+    (socket timeouts and retries are capped by it), so a chunk can't run past the budget;
+    should the run still be killed, requeue_stale() returns its claims after `lease_seconds`.
+    """
+    deadline = time.monotonic() + time_budget
+    stats = {'sent': 0, 'retry': 0, 'failed': 0, 'requeued': requeue_stale(db, lease_seconds), 'released': 0}
+    rate = getattr(getattr(sender, 'limiter', None), 'rate', 0) or 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        limit = batch_size if rate <= 0 else max(1, min(batch_size, int(remaining * rate)))
+        # Only messages whose backoff has elapsed (composite index in firestore.indexes.json)
+        due = (db.collection(OUTBOX_COLLECTION)
+               .where('status', '==', 'pending')
+               .where('next_attempt_at', '<=', datetime.now(timezone.utc)))
+        snaps = list(due.limit(limit).stream())
+        if not snaps:
+            break
+        claimed = _claim(db, snaps)
+
+        for start in range(0, len(claimed), chunk_size):
+            if time.monotonic() >= deadline:
+                # Out of budget: hand the rest back untouched for the next run
+                release = db.bulk_writer()
+                for snap in claimed[start:]:
+                    release.update(snap.reference, {'status': 'pending'})
+                release.close()
+                stats['released'] += len(claimed) - start
+                return stats
+            _record(db, sender, claimed[start:start + chunk_size], stats, deadline)
+        if len(snaps) < limit:
+            break
+    return stats
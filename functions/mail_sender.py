@@ -0,0 +1,196 @@
+# Batched SMTP delivery over pooled connections, with retry and rate limiting.
+#
+# Local stand-in for development:
+#   python -m aiosmtpd -n -l localhost:1025
+#   SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=false ...
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from typing import List, Optional, Tuple
+
+# send() result for a message whose first attempt would have started past its deadline
+NOT_ATTEMPTED = "not attempted: deadline reached"
+
+
+class RateLimiter:
+    """Token bucket shared by all sending threads."""
+
+    def __init__(self, rate_per_sec: float, burst: Optional[int] = None):
+        self.rate = rate_per_sec
+        self.capacity = float(burst or max(1, int(rate_per_sec)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SmtpSender:
+    """Sends batches of messages over a small pool of long-lived SMTP connections.
+
+    Each connection is reused for up to `max_per_connection` messages (then recycled);
+    transient failures are retried with backoff on a fresh connection, permanent 5xx
+    rejections are not. With a deadline, socket timeouts and retries are cut to fit it.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 587,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = True,
+        use_ssl: bool = False,
+        from_address: str = "MyChannel <no-reply@mychannel.live>",
+        pool_size: int = 4,
+        rate_per_sec: float = 10.0,
+        max_per_connection: int = 100,
+        max_retries: int = 3,
+        timeout: float = 30.0,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.from_address = from_address
+        self.pool_size = pool_size
+        self.max_per_connection = max_per_connection
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate_per_sec)
+        self._idle: "queue.LifoQueue[Tuple[smtplib.SMTP, int]]" = queue.LifoQueue()
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="smtp")
+
+    @classmethod
+    def from_env(cls) -> "SmtpSender":
+        return cls(
+            host=os.environ.get("SMTP_HOST", "localhost"),
+            port=int(os.environ.get("SMTP_PORT", "587")),
+            username=os.environ.get("SMTP_USER") or None,
+            password=os.environ.get("SMTP_PASSWORD") or None,
+            starttls=os.environ.get("SMTP_STARTTLS", "true").lower() == "true",
+            use_ssl=os.environ.get("SMTP_SSL", "false").lower() == "true",
+            from_address=os.environ.get("SMTP_FROM", "MyChannel <no-reply@mychannel.live>"),
+            pool_size=int(os.environ.get("SMTP_POOL_SIZE", "4")),
+            rate_per_sec=float(os.environ.get("MAIL_RATE_PER_SEC", "10")),
+        )
+
+    # --- Connection pool ---
+    def _connect(self, timeout: float) -> smtplib.SMTP:
+        if self.use_ssl:
+            conn: smtplib.SMTP = smtplib.SMTP_SSL(self.host, self.port, timeout=timeout)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=timeout)
+            if self.starttls:
+                conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password or "")
+        return conn
+
+    def _checkout(self, timeout: float) -> Tuple[smtplib.SMTP, int]:
+        try:
+            conn, used = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect(timeout), 0
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, used
+
+    def _checkin(self, conn: smtplib.SMTP, used: int) -> None:
+        if used >= self.max_per_connection:
+            self._quit(conn)
+        else:
+            self._idle.put((conn, used))
+
+    @staticmethod
+    def _quit(conn: smtplib.SMTP) -> None:
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(conn)
+
+    # --- Sending ---
+    def build(self, to: str, subject: str, html_body: str) -> EmailMessage:
+        msg = EmailMessage()
+        msg["From"] = self.from_address
+        msg["To"] = to
+        msg["Subject"] = subject
+        msg.set_content("Open this email in an HTML-capable client to view it.")
+        msg.add_alternative(html_body, subtype="html")
+        return msg
+
+    def send(self, message: EmailMessage, deadline: Optional[float] = None) -> Optional[str]:
+        """Send one message; returns None on success or the final error string.
+
+        `deadline` (a time.monotonic() value) caps every socket wait and stops retrying once
+        reached; a message that never got an attempt returns NOT_ATTEMPTED.
+        """
+        error: Optional[str] = None
+        for attempt in range(self.max_retries):
+            self.limiter.acquire()
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    return error or NOT_ATTEMPTED
+            conn, used = None, 0
+            try:
+                conn, used = self._checkout(timeout)
+                conn.send_message(message)
+                self._checkin(conn, used + 1)
+                return None
+            except smtplib.SMTPResponseException as e:
+                error = f"{e.smtp_code} {e.smtp_error!r}"
+                if conn is not None:
+                    self._checkin(conn, used + 1)
+                if 500 <= e.smtp_code < 600:
+                    return error  # permanent rejection; retrying won't help
+            except smtplib.SMTPRecipientsRefused as e:
+                self._checkin(conn, used + 1)
+                return f"recipients refused: {list(e.recipients)}"
+            except (smtplib.SMTPException, OSError) as e:
+                # Broken connection: drop it and retry on a fresh one
+                error = str(e)
+                if conn is not None:
+                    conn.close()
+            logging.warning("SMTP send attempt %d to %s failed: %s", attempt + 1, message["To"], error)
+            if attempt + 1 < self.max_retries:
+                pause = min(8.0, 0.5 * (2 ** attempt))
+                if deadline is not None and time.monotonic() + pause >= deadline:
+                    break
+                time.sleep(pause)
+        return error
+
+    def send_batch(
+        self, messages: List[Tuple[str, EmailMessage]], deadline: Optional[float] = None
+    ) -> List[Tuple[str, Optional[str]]]:
+        """Send (id, message) pairs across the pool; returns (id, error-or-None) in input order."""
+        futures = [(msg_id, self._pool.submit(self.send, msg, deadline)) for msg_id, msg in messages]
+        return [(msg_id, fut.result()) for msg_id, fut in futures]
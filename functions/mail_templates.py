@@ -0,0 +1,97 @@
+# Compiled per-language email templates (templates/<kind>.<lang>.html)
+import html
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+DEFAULT_LANGUAGE = "en"
+_FIELD_RE = re.compile(r"\{\{\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*\}\}")
+
+
+class CompiledTemplate:
+    """A template split once into static chunks and field slots.
+
+    Rendering only escapes and joins the per-user fields between the cached chunks.
+    The first line of a template file is `Subject: ...`; the rest is the HTML body.
+    """
+
+    def __init__(self, source: str):
+        first, _, body = source.partition("\n")
+        if not first.startswith("Subject:"):
+            raise ValueError("template must start with a 'Subject:' line")
+        self.subject = self._compile(first[len("Subject:"):].strip())
+        self.html = self._compile(body)
+
+    @staticmethod
+    def _compile(text: str) -> Tuple[List[str], List[str]]:
+        statics: List[str] = []
+        fields: List[str] = []
+        pos = 0
+        for m in _FIELD_RE.finditer(text):
+            statics.append(text[pos:m.start()])
+            fields.append(m.group(1))
+            pos = m.end()
+        statics.append(text[pos:])
+        return statics, fields
+
+    @staticmethod
+    def _fill(compiled: Tuple[List[str], List[str]], values: Dict[str, str], escape: bool) -> str:
+        statics, fields = compiled
+        out = [statics[0]]
+        for name, static in zip(fields, statics[1:]):
+            value = str(values.get(name, ""))
+            out.append(html.escape(value) if escape else value)
+            out.append(static)
+        return "".join(out)
+
+    def render(self, values: Dict[str, str]) -> Tuple[str, str]:
+        """Return (subject, html) for one recipient."""
+        return self._fill(self.subject, values, escape=False), self._fill(self.html, values, escape=True)
+
+
+class TemplateEngine:
+    """Loads and compiles each (kind, language) template once per instance, falling back to English."""
+
+    def __init__(self, root: str = TEMPLATE_DIR, default_language: str = DEFAULT_LANGUAGE):
+        self.root = root
+        self.default_language = default_language
+        self._cache: Dict[Tuple[str, str], CompiledTemplate] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, kind: str, language: str) -> Optional[CompiledTemplate]:
+        path = os.path.join(self.root, f"{kind}.{language}.html")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return CompiledTemplate(f.read())
+
+    def get(self, kind: str, language: Optional[str]) -> CompiledTemplate:
+        # Normalize e.g. "es-MX" -> "es"
+        language = (language or self.default_language).split("-")[0].split("_")[0].lower()
+        key = (kind, language)
+        template = self._cache.get(key)
+        if template is not None:
+            return template
+        with self._lock:
+            template = self._cache.get(key)
+            if template is None:
+                template = self._load(kind, language) or self._load(kind, self.default_language)
+                if template is None:
+                    raise KeyError(f"no template for {kind!r}")
+                self._cache[key] = template
+        return template
+
+    def render(self, kind: str, language: Optional[str], values: Dict[str, str]) -> Tuple[str, str]:
+        return self.get(kind, language).render(values)
+
+
+_engine: Optional[TemplateEngine] = None
+
+
+def get_engine() -> TemplateEngine:
+    global _engine
+    if _engine is None:
+        _engine = TemplateEngine()
+    return _engine
@@ -1,62 +1,101 @@
 # Simple Firebase Functions for MyChannel
-from firebase_functions import firestore_fn, https_fn
+from firebase_functions import firestore_fn, https_fn, scheduler_fn
 from firebase_admin import initialize_app, firestore
 import logging
 import os
 import requests
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+from http_encoding import encode_json
+from mail_outbox import drain_outbox
+from mail_sender import SmtpSender
+from ranking import RankingEngine
+from retrieval import CandidateRetriever
+from user_emails import process_welcome_email, process_thank_you_email
+
+_ranker: Optional[RankingEngine] = None
+_retriever: Optional[CandidateRetriever] = None
+RANK_RETRIEVAL_SIZE = int(os.environ.get("RANK_RETRIEVAL_SIZE", "300"))
+
+
+def get_ranker() -> RankingEngine:
+    """Per-instance ranking engine; Vertex init happens once, on first use."""
+    global _ranker
+    if _ranker is None:
+        _ranker = RankingEngine(
+            project=os.environ.get("GOOGLE_CLOUD_PROJECT") or os.environ.get("GCP_PROJECT"),
+            location=os.environ.get("VERTEX_LOCATION", "us-central1"),
+            model_name=os.environ.get("VERTEX_RANKING_MODEL"),  # optional custom model
+            half_life_days=float(os.environ.get("RANK_RECENCY_HALF_LIFE_DAYS", "7")),
+        )
+    return _ranker
+
+
+def json_response(req: https_fn.Request, payload: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> https_fn.Response:
+    """JSON response with a strong ETag (304 on If-None-Match) and gzip/brotli when it pays off."""
+    body, status, headers = encode_json(req, payload, status=status, headers=headers)
+    return https_fn.Response(body, status=status, headers=headers)
+
+
+def get_retriever() -> CandidateRetriever:
+    """Per-instance ANN index, seeded from RANK_INDEX_SNAPSHOT when present."""
+    global _retriever
+    if _retriever is None:
+        _retriever = CandidateRetriever.from_env()
+    return _retriever
+
 
-try:
-    # Vertex AI optional import; functions can still run without this configured
-    from google.cloud import aiplatform
-except Exception:
-    aiplatform = None
 # --- HTTPS Proxies ---
 @https_fn.on_request()
 def ai_rank(req: https_fn.Request) -> https_fn.Response:
-    """Rank a list of items using Vertex AI (optional). Expects JSON: {items:[{id, title, tags, views, createdAt}], user:{id}}.
-    If Vertex isn't configured, returns items unchanged with uniform scores.
+    """Rank a list of items using Vertex AI (optional). Expects JSON: {items:[{id, title, tags, views, createdAt}], user:{id, history}, k}.
+    `user.history` (item ids or item objects, oldest first unless every entry has a watchedAt) narrows items to the user's nearest
+    RANK_RETRIEVAL_SIZE candidates before scoring. Returns the top `k` items (all when omitted) best first.
+    If Vertex isn't configured, returns the (retrieved) items in order with uniform scores.
     """
     try:
         body = req.get_json(silent=True) or {}
         items: List[Dict[str, Any]] = body.get("items", [])
-        user: Dict[str, Any] = body.get("user", {})
+        user = body.get("user") or {}
+        if not isinstance(user, dict):
+            return json_response(req, {"error": "user must be an object"}, status=400,
+                                 headers={"Access-Control-Allow-Origin": "*"})
+        history = user.get("history")
+        if history is not None and not isinstance(history, list):
+            return json_response(req, {"error": "user.history must be a list"}, status=400,
+                                 headers={"Access-Control-Allow-Origin": "*"})
+        k = body.get("k")
+        if isinstance(k, str) and k.strip().isdigit():
+            k = int(k)
+        if k is not None and (isinstance(k, bool) or not isinstance(k, int) or k < 0):
+            return json_response(req, {"error": "k must be a non-negative integer"}, status=400,
+                                 headers={"Access-Control-Allow-Origin": "*"})
 
         # Default: passthrough
         if not items:
-            return https_fn.Response({"items": []}, status=200, headers={"Access-Control-Allow-Origin": "*"})
-
-        project = os.environ.get("GOOGLE_CLOUD_PROJECT") or os.environ.get("GCP_PROJECT")
-        location = os.environ.get("VERTEX_LOCATION", "us-central1")
-        model_name = os.environ.get("VERTEX_RANKING_MODEL")  # optional custom model
-
-        if aiplatform is None or not project:
-            scored = [{**it, "score": 1.0} for it in items]
-            return https_fn.Response({"items": scored}, status=200, headers={"Access-Control-Allow-Origin": "*"})
-
-        aiplatform.init(project=project, location=location)
-
-        # Simple feature mapping; replace with your model endpoint if available
-        # For demo, we compute a lightweight heuristic score and return
-        def heuristic(it: Dict[str, Any]) -> float:
-            views = float(it.get("views", 0) or 0)
-            recency = 0.0
-            try:
-                # Expect ISO date or epoch
-                created = it.get("createdAt")
-                if isinstance(created, (int, float)):
-                    recency = max(0.0, 1.0 - ( ( ( ( ( ( ( ( ( (0) ) ) ) ) ) ) ) ) ))
-            except Exception:
-                pass
-            title_boost = 1.0 + (0.2 if str(it.get("title",""))[:1].isupper() else 0.0)
-            return title_boost + (views ** 0.5) * 0.01
-
-        scored = sorted(([{**it, "score": heuristic(it)} for it in items]), key=lambda x: x["score"], reverse=True)
-        return https_fn.Response({"items": scored}, status=200, headers={"Access-Control-Allow-Origin": "*"})
+            return json_response(req, {"items": []}, status=200, headers={"Access-Control-Allow-Origin": "*"})
+
+        # Retrieval is CPU-only, so it narrows candidates whether or not Vertex is configured
+        retriever = get_retriever()
+        retriever.refresh(items)
+        retrieved = retriever.candidates(user, items, RANK_RETRIEVAL_SIZE)
+
+        ranker = get_ranker()
+        if not ranker.vertex_enabled:
+            passthrough = retrieved[0] if retrieved is not None else items
+            scored = [{**it, "score": 1.0} for it in passthrough[:k]]
+            return json_response(req, {"items": scored}, status=200, headers={"Access-Control-Allow-Origin": "*"})
+
+        if retrieved is not None:
+            candidates, affinity = retrieved
+            scored = ranker.rank(candidates, k=k, affinity=affinity)
+        else:
+            scored = ranker.rank(items, k=k)
+        return json_response(req, {"items": scored}, status=200, headers={"Access-Control-Allow-Origin": "*"})
     except Exception as e:
         logging.exception("ai_rank error")
-        return https_fn.Response({"error": str(e)}, status=500, headers={"Access-Control-Allow-Origin": "*"})
+        return json_response(req, {"error": str(e)}, status=500, headers={"Access-Control-Allow-Origin": "*"})
 
 # Initialize Firebase Admin
 initialize_app()
@@ -77,33 +116,21 @@ FREE_PROVIDERS = {
 if ENABLE_EMAIL_TRIGGERS:
     @firestore_fn.on_document_created(document="users/{userId}")
     def send_welcome_email(event: firestore_fn.Event[firestore_fn.DocumentSnapshot]) -> None:
-        """Trigger when a new user is created"""
+        """Trigger when a new user is created. Users created while triggers were off: see welcome_backfill.py"""
         try:
             # Get user data
             user_data = event.data.to_dict()
-            email = user_data.get('email')
-            username = user_data.get('displayName', 'Creator')
             user_id = event.params['userId']
-            language = user_data.get('preferredLanguage', 'en')
 
-            if not email:
-                logging.error("No email found for user")
+            db = firestore.client()
+            update = process_welcome_email(db, user_id, user_data)
+            if update is None:
                 return
 
-            # For now, just log the beautiful email that would be sent
-            logging.info(f"🎬 Beautiful welcome email for {username} ({email}) in {language}")
-            logging.info("Subject: 🎬 Welcome to MyChannel - Verify Your Account!")
-            logging.info("Template: Multi-language HTML with MyChannel branding")
-
             # Update user document to track email
-            db = firestore.client()
-            db.collection('users').document(user_id).update({
-                'welcome_email_sent': True,
-                'welcome_email_sent_at': firestore.SERVER_TIMESTAMP,
-                'email_language': language
-            })
+            db.collection('users').document(user_id).update(update)
 
-            print(f"✅ Welcome email processed for {username} in {language}")
+            print(f"✅ Welcome email processed for {user_data.get('displayName', 'Creator')} in {update['email_language']}")
         except Exception as e:
             logging.error(f"❌ Error processing welcome email: {str(e)}")
 
@@ -120,29 +147,44 @@ if ENABLE_EMAIL_TRIGGERS:
                 return
 
             user_id = event.params['userId']
-            email = after_data.get('email')
-            username = after_data.get('displayName', 'Creator')
-            language = after_data.get('preferredLanguage', 'en')
-
-            if not email:
+            db = firestore.client()
+            update = process_thank_you_email(db, user_id, after_data)
+            if update is None:
                 return
 
-            # Log the thank you email that would be sent
-            logging.info(f"🎉 Thank you email for verified user {username} ({email}) in {language}")
-            logging.info("Subject: 🎉 You're verified - Welcome to MyChannel!")
-            logging.info("Template: Celebration email with creator benefits")
-
             # Update user document
-            db = firestore.client()
-            db.collection('users').document(user_id).update({
-                'thank_you_email_sent': True,
-                'thank_you_email_sent_at': firestore.SERVER_TIMESTAMP
-            })
+            db.collection('users').document(user_id).update(update)
 
-            print(f"✅ Thank you email processed for verified user {username}")
+            print(f"✅ Thank you email processed for verified user {after_data.get('displayName', 'Creator')}")
         except Exception as e:
             logging.error(f"❌ Error processing thank you email: {str(e)}")
 
+_mail_sender: Optional[SmtpSender] = None
+
+# The outbox is filled by the email triggers and by welcome_backfill.py, so draining has its
+# own switch; enable it once SMTP_* is configured (otherwise every send fails and burns attempts)
+ENABLE_MAIL_DRAIN = os.environ.get("ENABLE_MAIL_DRAIN", "false").lower() == "true"
+
+if ENABLE_MAIL_DRAIN:
+    @scheduler_fn.on_schedule(schedule="every 1 minutes")
+    def drain_mail_outbox(event: scheduler_fn.ScheduledEvent) -> None:
+        """Send queued emails in batches over the instance's pooled SMTP connections."""
+        global _mail_sender
+        try:
+            if _mail_sender is None:
+                _mail_sender = SmtpSender.from_env()
+            # Stay well inside the function's default 60 s timeout
+            stats = drain_outbox(
+                firestore.client(),
+                _mail_sender,
+                batch_size=int(os.environ.get("MAIL_BATCH_SIZE", "200")),
+                time_budget=float(os.environ.get("MAIL_DRAIN_BUDGET_SECONDS", "45")),
+            )
+            if any(stats.values()):
+                logging.info(f"📬 Mail outbox drained: {stats}")
+        except Exception as e:
+            logging.error(f"❌ Error draining mail outbox: {str(e)}")
+
 
 # --- HTTPS Proxies ---
 @https_fn.on_request()
@@ -179,10 +221,10 @@ def tmdb_popular(req: https_fn.Request) -> https_fn.Response:
                 "release_date": m.get("release_date", "")
             })
 
-        return https_fn.Response({"items": items}, status=200)
+        return json_response(req, {"items": items}, status=200)
     except Exception as e:
         logging.exception("TMDB proxy error")
-        return https_fn.Response({"error": str(e)}, status=500)
+        return json_response(req, {"error": str(e)}, status=500)
 
 
 # --- HTTPS: Free/Ads-supported movies (US) ---
@@ -192,7 +234,7 @@ def tmdb_free_ads(req: https_fn.Request) -> https_fn.Response:
     try:
         api_key = os.environ.get("TMDB_API_KEY", "")
         if not api_key:
-            return https_fn.Response({"error": "Missing TMDB API key"}, status=500, headers={"Access-Control-Allow-Origin": "*"})
+            return json_response(req, {"error": "Missing TMDB API key"}, status=500, headers={"Access-Control-Allow-Origin": "*"})
 
         page = req.args.get("page", "1")
         region = req.args.get("region", "US")
@@ -243,10 +285,10 @@ def tmdb_free_ads(req: https_fn.Request) -> https_fn.Response:
                 "genre_ids": m.get("genre_ids", [])
             })
 
-        return https_fn.Response({"items": items, "provider": provider}, status=200, headers={"Access-Control-Allow-Origin": "*"})
+        return json_response(req, {"items": items, "provider": provider}, status=200, headers={"Access-Control-Allow-Origin": "*"})
     except Exception as e:
         logging.exception("TMDB free/ads proxy error")
-        return https_fn.Response({"error": str(e)}, status=500, headers={"Access-Control-Allow-Origin": "*"})
+        return json_response(req, {"error": str(e)}, status=500, headers={"Access-Control-Allow-Origin": "*"})
 
 
 @https_fn.on_request()
@@ -255,7 +297,7 @@ def tmdb_trending(req: https_fn.Request) -> https_fn.Response:
     try:
         api_key = os.environ.get("TMDB_API_KEY", "")
         if not api_key:
-            return https_fn.Response({"error": "Missing TMDB API key"}, status=500, headers={"Access-Control-Allow-Origin": "*"})
+            return json_response(req, {"error": "Missing TMDB API key"}, status=500, headers={"Access-Control-Allow-Origin": "*"})
 
         media_type = req.args.get("media_type", "movie")  # movie, tv, all
         time_window = req.args.get("time_window", "week")  # day, week
@@ -285,10 +327,10 @@ def tmdb_trending(req: https_fn.Request) -> https_fn.Response:
                 "media_type": m.get("media_type", media_type)
             })
 
-        return https_fn.Response({"items": items, "media_type": media_type}, status=200, headers={"Access-Control-Allow-Origin": "*"})
+        return json_response(req, {"items": items, "media_type": media_type}, status=200, headers={"Access-Control-Allow-Origin": "*"})
     except Exception as e:
         logging.exception("TMDB trending proxy error")
-        return https_fn.Response({"error": str(e)}, status=500, headers={"Access-Control-Allow-Origin": "*"})
+        return json_response(req, {"error": str(e)}, status=500, headers={"Access-Control-Allow-Origin": "*"})
 
 
 @https_fn.on_request()
@@ -297,13 +339,13 @@ def tmdb_details(req: https_fn.Request) -> https_fn.Response:
     try:
         api_key = os.environ.get("TMDB_API_KEY", "")
         if not api_key:
-            return https_fn.Response({"error": "Missing TMDB API key"}, status=500, headers={"Access-Control-Allow-Origin": "*"})
+            return json_response(req, {"error": "Missing TMDB API key"}, status=500, headers={"Access-Control-Allow-Origin": "*"})
 
         media_type = req.args.get("media_type", "movie")  # movie or tv
         media_id = req.args.get("id")
         
         if not media_id:
-            return https_fn.Response({"error": "Missing media ID"}, status=400, headers={"Access-Control-Allow-Origin": "*"})
+            return json_response(req, {"error": "Missing media ID"}, status=400, headers={"Access-Control-Allow-Origin": "*"})
 
         # Get basic details
         details_url = f"https://api.themoviedb.org/3/{media_type}/{media_id}"
@@ -350,7 +392,7 @@ def tmdb_details(req: https_fn.Request) -> https_fn.Response:
             "media_type": media_type
         }
 
-        return https_fn.Response(result, status=200, headers={"Access-Control-Allow-Origin": "*"})
+        return json_response(req, result, status=200, headers={"Access-Control-Allow-Origin": "*"})
     except Exception as e:
         logging.exception("TMDB details proxy error")
-        return https_fn.Response({"error": str(e)}, status=500, headers={"Access-Control-Allow-Origin": "*"})
\ No newline at end of file
+        return json_response(req, {"error": str(e)}, status=500, headers={"Access-Control-Allow-Origin": "*"})
\ No newline at end of file
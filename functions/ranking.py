@@ -0,0 +1,146 @@
+# Vectorized feed ranking for ai_rank
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+try:
+    # Vertex AI optional import; ranking still works without it
+    from google.cloud import aiplatform
+except Exception:
+    aiplatform = None
+
+
+def _epoch_seconds(created: Any) -> float:
+    """Parse createdAt (ISO string, epoch seconds or epoch millis) to epoch seconds; NaN if unknown."""
+    if created is None or isinstance(created, bool):
+        return np.nan
+    if isinstance(created, (int, float)):
+        value = float(created)
+        # Heuristic: anything past year ~2286 in seconds is really milliseconds
+        return value / 1000.0 if value > 1e10 else value
+    if isinstance(created, str) and created:
+        try:
+            dt = datetime.fromisoformat(created.replace("Z", "+00:00"))
+        except ValueError:
+            try:
+                return _epoch_seconds(float(created))
+            except ValueError:
+                return np.nan
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    return np.nan
+
+
+class RankingEngine:
+    """Scores feed candidates in one NumPy pass and returns the top-k.
+
+    Feature extraction is the only per-item Python work; scoring and selection
+    are vectorized, and only the selected items are copied into the response.
+    """
+
+    def __init__(
+        self,
+        project: Optional[str] = None,
+        location: str = "us-central1",
+        model_name: Optional[str] = None,
+        half_life_days: float = 7.0,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        self.project = project
+        self.location = location
+        self.model_name = model_name
+        self.half_life_seconds = half_life_days * 86400.0
+        self.weights = {
+            "title": 1.0,
+            "title_cap": 0.2,
+            "views": 0.01,
+            "recency": 1.0,
+            "tags": 0.1,
+            "affinity": 1.0,
+        }
+        if weights:
+            self.weights.update(weights)
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    @property
+    def vertex_enabled(self) -> bool:
+        return aiplatform is not None and bool(self.project)
+
+    def ensure_initialized(self) -> None:
+        """Run Vertex init once per instance instead of once per request."""
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            if self.vertex_enabled:
+                aiplatform.init(project=self.project, location=self.location)
+                logging.info("RankingEngine initialized Vertex AI for %s/%s", self.project, self.location)
+            self._initialized = True
+
+    def features(self, items: List[Dict[str, Any]], now: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """Extract per-item features into NumPy columns."""
+        n = len(items)
+        now = time.time() if now is None else now
+        views = np.fromiter((float(it.get("views", 0) or 0) for it in items), dtype=np.float64, count=n)
+        created = np.fromiter((_epoch_seconds(it.get("createdAt")) for it in items), dtype=np.float64, count=n)
+        titles = [str(it.get("title", "") or "") for it in items]
+        title_cap = np.fromiter((1.0 if t[:1].isupper() else 0.0 for t in titles), dtype=np.float64, count=n)
+        tag_counts = np.fromiter((len(t) if isinstance(t, (list, tuple)) else 0.0 for t in (it.get("tags") for it in items)),
+                                 dtype=np.float64, count=n)
+
+        age = np.clip(now - created, 0.0, None)
+        # Exponential decay with the configured half-life; unknown dates contribute nothing
+        recency = np.where(np.isnan(age), 0.0, np.exp2(-age / self.half_life_seconds))
+
+        return {
+            "views": np.clip(views, 0.0, None),
+            "recency": recency,
+            "title_cap": title_cap,
+            "tags": np.minimum(tag_counts, 5.0) / 5.0,
+        }
+
+    def score(self, items: List[Dict[str, Any]], now: Optional[float] = None, affinity: Optional[np.ndarray] = None) -> np.ndarray:
+        f = self.features(items, now=now)
+        w = self.weights
+        scores = (
+            w["title"]
+            + w["title_cap"] * f["title_cap"]
+            + w["views"] * np.sqrt(f["views"])
+            + w["recency"] * f["recency"]
+            + w["tags"] * f["tags"]
+        )
+        if affinity is not None:
+            # User/item similarity from the retrieval stage
+            scores = scores + w["affinity"] * np.asarray(affinity, dtype=np.float64)
+        return scores
+
+    @staticmethod
+    def top_k(scores: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+        """Indices of the k best scores, best first, using partial selection."""
+        n = scores.shape[0]
+        if k is None or k >= n:
+            return np.argsort(-scores, kind="stable")
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+        idx = np.argpartition(-scores, k - 1)[:k]
+        return idx[np.argsort(-scores[idx], kind="stable")]
+
+    def rank(
+        self,
+        items: List[Dict[str, Any]],
+        k: Optional[int] = None,
+        now: Optional[float] = None,
+        affinity: Optional[np.ndarray] = None,
+    ) -> List[Dict[str, Any]]:
+        if not items:
+            return []
+        self.ensure_initialized()
+        scores = self.score(items, now=now, affinity=affinity)
+        return [{**items[i], "score": float(scores[i])} for i in self.top_k(scores, k)]
@@ -0,0 +1,391 @@
+# Personalized candidate retrieval for ai_rank (CPU-only, in-memory)
+#
+# Build an index snapshot from a catalog export (JSON list or JSON lines of items) so cold
+# instances start without re-embedding the catalog; point RANK_INDEX_SNAPSHOT at the output:
+#   python retrieval.py --items catalog.json --out rank_index.npz
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+
+import numpy as np
+
+from ranking import _epoch_seconds
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _tags(item: Dict[str, Any]) -> List[Any]:
+    tags = item.get("tags")
+    return list(tags) if isinstance(tags, (list, tuple)) else []
+
+
+class ItemEmbedder:
+    """Hashing-trick embeddings from an item's title tokens and tags.
+
+    Uses crc32 rather than hash() so vectors are stable across processes and
+    can be persisted in index snapshots.
+    """
+
+    def __init__(self, dim: int = 128, tag_weight: float = 2.0):
+        self.dim = dim
+        self.tag_weight = tag_weight
+
+    def _bucket(self, token: str) -> Tuple[int, float]:
+        h = zlib.crc32(token.encode("utf-8"))
+        return h % self.dim, (1.0 if (h >> 31) & 1 else -1.0)
+
+    def embed(self, items: List[Dict[str, Any]]) -> np.ndarray:
+        out = np.zeros((len(items), self.dim), dtype=np.float32)
+        for row, it in enumerate(items):
+            tokens: Iterable[str] = _TOKEN_RE.findall(str(it.get("title", "") or "").lower())
+            for tok in tokens:
+                col, sign = self._bucket("t:" + tok)
+                out[row, col] += sign
+            for tag in _tags(it):
+                col, sign = self._bucket("g:" + str(tag).strip().lower())
+                out[row, col] += sign * self.tag_weight
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+class AnnIndex:
+    """Inverted-file (IVF) approximate nearest-neighbour index over unit vectors.
+
+    Vectors are bucketed by their nearest k-means centroid; a query only scores
+    the `n_probe` closest buckets. Rows can be upserted or removed in place, and
+    the whole index round-trips through a single .npz snapshot.
+    """
+
+    def __init__(self, dim: int, n_lists: int = 64, n_probe: int = 8, train_min: int = 1024):
+        self.dim = dim
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_min = train_min
+        self.centroids: Optional[np.ndarray] = None
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._assign = np.zeros(0, dtype=np.int32)  # -1 = deleted row
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._rows
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            return list(self._rows)
+
+    def get(self, item_id: str) -> Optional[np.ndarray]:
+        return self.get_many([item_id])[0]
+
+    def get_many(self, ids: Iterable[str]) -> List[Optional[np.ndarray]]:
+        """Copies of the stored vectors for `ids` (None where unknown), read under one lock hold
+        so a concurrent upsert or compaction can't remap rows halfway through."""
+        with self._lock:
+            rows = [self._rows.get(item_id) for item_id in ids]
+            return [None if row is None else self._vectors[row].copy() for row in rows]
+
+    # --- Training / assignment ---
+    def _train(self, iterations: int = 8) -> None:
+        live = self._vectors[self._assign >= 0]
+        n_lists = min(self.n_lists, len(live))
+        if n_lists == 0:
+            return
+        rng = np.random.default_rng(0)
+        centroids = live[rng.choice(len(live), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(live @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = live[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            np.divide(centroids, norms, out=centroids, where=norms > 0)
+        self.centroids = centroids
+        self._assign[self._assign >= 0] = self._nearest(self._vectors[self._assign >= 0])
+        logging.info("AnnIndex trained %d lists over %d vectors", n_lists, len(live))
+
+    def _nearest(self, vectors: np.ndarray) -> np.ndarray:
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int32)
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    # --- Mutation ---
+    def upsert(self, ids: List[str], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            new_ids, new_vecs = [], []
+            for item_id, vec in zip(ids, vectors):
+                row = self._rows.get(item_id)
+                if row is None:
+                    new_ids.append(item_id)
+                    new_vecs.append(vec)
+                else:
+                    self._vectors[row] = vec
+                    self._assign[row] = self._nearest(vec[None, :])[0]
+            if new_ids:
+                start = len(self._ids)
+                block = np.stack(new_vecs)
+                self._vectors = np.concatenate([self._vectors, block])
+                self._assign = np.concatenate([self._assign, self._nearest(block)])
+                self._ids.extend(new_ids)
+                for offset, item_id in enumerate(new_ids):
+                    self._rows[item_id] = start + offset
+            if self.centroids is None and len(self._rows) >= self.train_min:
+                self._train()
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for item_id in ids:
+                row = self._rows.pop(item_id, None)
+                if row is not None:
+                    self._assign[row] = -1
+            # Reclaim memory once deleted rows outnumber live ones
+            if len(self._ids) > 2 * len(self._rows):
+                self._compact()
+
+    def _compact(self) -> None:
+        live = self._assign >= 0
+        self._vectors = self._vectors[live]
+        self._assign = self._assign[live]
+        self._ids = [i for i, keep in zip(self._ids, live) if keep]
+        self._rows = {item_id: row for row, item_id in enumerate(self._ids)}
+
+    # --- Query ---
+    def search(self, query: np.ndarray, k: int, allowed: Optional[Iterable[str]] = None) -> Tuple[List[str], np.ndarray]:
+        """Return up to k (ids, similarities) best first, optionally restricted to `allowed` ids."""
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            if allowed is not None:
+                rows = np.fromiter((self._rows[i] for i in allowed if i in self._rows), dtype=np.intp)
+            else:
+                rows = np.flatnonzero(self._assign >= 0)
+            if self.centroids is not None and len(rows) > k:
+                probe = np.argsort(-(self.centroids @ query))[: self.n_probe]
+                probed = rows[np.isin(self._assign[rows], probe)]
+                # Too few hits in the probed lists: fall back to an exact scan
+                if len(probed) >= k:
+                    rows = probed
+            if len(rows) == 0:
+                return [], np.zeros(0, dtype=np.float32)
+            sims = self._vectors[rows] @ query
+            if k < len(rows):
+                top = np.argpartition(-sims, k - 1)[:k]
+            else:
+                top = np.arange(len(rows))
+            top = top[np.argsort(-sims[top], kind="stable")]
+            return [self._ids[r] for r in rows[top]], sims[top]
+
+    # --- Persistence ---
+    def save(self, path: str, fingerprints: Optional[Dict[str, int]] = None) -> None:
+        """Write live rows to `path`, plus each row's content fingerprint (-1 if unknown)."""
+        fingerprints = fingerprints or {}
+        with self._lock:
+            live = self._assign >= 0
+            ids = [i for i, keep in zip(self._ids, live) if keep]
+            np.savez(
+                path,
+                dim=np.array(self.dim),
+                n_lists=np.array(self.n_lists),
+                n_probe=np.array(self.n_probe),
+                centroids=self.centroids if self.centroids is not None else np.zeros((0, self.dim), dtype=np.float32),
+                ids=np.array(ids, dtype=np.str_),
+                vectors=self._vectors[live],
+                assign=self._assign[live],
+                fingerprints=np.array([fingerprints.get(i, -1) for i in ids], dtype=np.int64),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> Tuple["AnnIndex", Dict[str, int]]:
+        """The index saved at `path` and the fingerprints stored with it."""
+        with np.load(path, allow_pickle=False) as snap:
+            index = cls(int(snap["dim"]), n_lists=int(snap["n_lists"]), n_probe=int(snap["n_probe"]))
+            centroids = snap["centroids"]
+            index.centroids = centroids if len(centroids) else None
+            index._vectors = snap["vectors"].astype(np.float32)
+            index._assign = snap["assign"].astype(np.int32)
+            index._ids = [str(i) for i in snap["ids"]]
+            stored = snap["fingerprints"] if "fingerprints" in snap.files else np.full(len(index._ids), -1)
+        index._rows = {item_id: row for row, item_id in enumerate(index._ids)}
+        fingerprints = {item_id: int(fp) for item_id, fp in zip(index._ids, stored) if fp >= 0}
+        return index, fingerprints
+
+
+class CandidateRetriever:
+    """Builds a user preference vector from watch history and pulls the nearest catalog items.
+
+    The index holds at most `max_items` items and drops any not seen in a request for `ttl`
+    seconds, least recently seen first.
+    """
+
+    def __init__(self, embedder: ItemEmbedder, index: AnnIndex, max_items: int = 50000, ttl: float = 7 * 86400.0,
+                 fingerprints: Optional[Dict[str, int]] = None):
+        self.embedder = embedder
+        self.index = index
+        self.max_items = max_items
+        self.ttl = ttl
+        # Known fingerprints (e.g. from a snapshot) let refresh skip items that haven't changed
+        self._fingerprints: Dict[str, int] = dict(fingerprints or {})
+        now = time.time()
+        self._seen: "OrderedDict[str, float]" = OrderedDict((item_id, now) for item_id in index.ids())
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "CandidateRetriever":
+        dim = int(os.environ.get("RANK_EMBED_DIM", "128"))
+        snapshot = os.environ.get("RANK_INDEX_SNAPSHOT")
+        index: Optional[AnnIndex] = None
+        fingerprints: Dict[str, int] = {}
+        if snapshot and os.path.exists(snapshot):
+            try:
+                index, fingerprints = AnnIndex.load(snapshot)
+                logging.info("Loaded ranking index snapshot %s (%d items)", snapshot, len(index))
+            except Exception as e:
+                logging.warning("Ranking index snapshot load failed: %s", e)
+        if index is None or index.dim != dim:
+            index, fingerprints = AnnIndex(dim, n_probe=int(os.environ.get("RANK_INDEX_PROBE", "8"))), {}
+        return cls(
+            ItemEmbedder(dim),
+            index,
+            max_items=int(os.environ.get("RANK_INDEX_MAX_ITEMS", "50000")),
+            ttl=float(os.environ.get("RANK_INDEX_TTL_SECONDS", str(7 * 86400))),
+            fingerprints=fingerprints,
+        )
+
+    def save(self, path: str) -> None:
+        """Snapshot the index with its fingerprints (loadable via RANK_INDEX_SNAPSHOT)."""
+        with self._lock:
+            self.index.save(path, fingerprints=self._fingerprints)
+
+    @staticmethod
+    def _fingerprint(item: Dict[str, Any]) -> int:
+        text = str(item.get("title", "") or "") + "\x00" + "\x00".join(str(t) for t in _tags(item))
+        return zlib.crc32(text.encode("utf-8"))
+
+    def refresh(self, items: List[Dict[str, Any]], now: Optional[float] = None) -> int:
+        """Index new items and re-embed ones whose title/tags changed; returns how many were embedded."""
+        now = time.time() if now is None else now
+        with self._lock:
+            changed: Dict[str, Dict[str, Any]] = {}
+            prints: Dict[str, int] = {}
+            for it in items:
+                if it.get("id") is None:
+                    continue
+                item_id = str(it["id"])
+                fp = self._fingerprint(it)
+                if self._fingerprints.get(item_id) != fp:
+                    changed[item_id] = it
+                    prints[item_id] = fp
+                self._seen[item_id] = now
+                self._seen.move_to_end(item_id)
+            if changed:
+                self.index.upsert(list(changed), self.embedder.embed(list(changed.values())))
+                self._fingerprints.update(prints)
+            self._evict(now)
+        return len(changed)
+
+    def _evict(self, now: float) -> None:
+        expired: List[str] = []
+        while self._seen:
+            item_id, seen = next(iter(self._seen.items()))
+            if len(self._seen) <= self.max_items and now - seen <= self.ttl:
+                break
+            self._seen.popitem(last=False)
+            self._fingerprints.pop(item_id, None)
+            expired.append(item_id)
+        if expired:
+            self.index.remove(expired)
+
+    @staticmethod
+    def _chronological(history: List[Any]) -> List[Any]:
+        """History oldest first: sorted by watchedAt/timestamp when every entry has one, else as given."""
+        stamps = [
+            _epoch_seconds(entry.get("watchedAt", entry.get("timestamp"))) if isinstance(entry, dict) else np.nan
+            for entry in history
+        ]
+        if not history or any(np.isnan(ts) for ts in stamps):
+            return list(history)
+        order = sorted(range(len(history)), key=stamps.__getitem__)
+        return [history[i] for i in order]
+
+    def user_vector(self, user: Dict[str, Any]) -> Optional[np.ndarray]:
+        """Mean of history embeddings, weighting recent watches higher."""
+        history = self._chronological(user.get("history") or [])
+        ids = [entry.get("id") if isinstance(entry, dict) else entry for entry in history]
+        known = iter(self.index.get_many([str(i) for i in ids if i is not None]))
+        slots: List[Optional[np.ndarray]] = []
+        to_embed: List[Tuple[int, Dict[str, Any]]] = []
+        for entry, item_id in zip(history, ids):
+            vec = next(known) if item_id is not None else None
+            if vec is None and isinstance(entry, dict):
+                to_embed.append((len(slots), entry))
+            slots.append(vec)
+        if to_embed:
+            for (slot, _), vec in zip(to_embed, self.embedder.embed([entry for _, entry in to_embed])):
+                slots[slot] = vec
+        # Keep history order so the recency weights line up with watch order
+        vecs = [vec for vec in slots if vec is not None]
+        if not vecs:
+            return None
+        weights = np.linspace(0.5, 1.0, num=len(vecs), dtype=np.float32)
+        pref = (np.stack(vecs) * weights[:, None]).sum(axis=0)
+        norm = np.linalg.norm(pref)
+        return pref / norm if norm > 0 else None
+
+    def candidates(self, user: Dict[str, Any], items: List[Dict[str, Any]], n: int) -> Optional[Tuple[List[Dict[str, Any]], np.ndarray]]:
+        """Best `n` of `items` for this user with their affinities, or None without usable history.
+
+        Items without an id can't be indexed; they are passed through after the retrieved ones
+        with a neutral affinity of 0.
+        """
+        pref = self.user_vector(user)
+        if pref is None:
+            return None
+        by_id = {str(it["id"]): it for it in items if it.get("id") is not None}
+        ids, sims = self.index.search(pref, n, allowed=by_id.keys())
+        anonymous = [it for it in items if it.get("id") is None]
+        if anonymous:
+            sims = np.concatenate([sims, np.zeros(len(anonymous), dtype=np.float32)])
+        return [by_id[i] for i in ids] + anonymous, sims
+
+
+def _read_items(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        data = data.get("items", [])
+    return [it for it in data if isinstance(it, dict)]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Build a ranking index snapshot from a catalog export.")
+    parser.add_argument("--items", required=True, help="JSON list (or JSON lines) of items with id, title, tags")
+    parser.add_argument("--out", required=True, help="Snapshot path (.npz) for RANK_INDEX_SNAPSHOT")
+    parser.add_argument("--dim", type=int, default=int(os.environ.get("RANK_EMBED_DIM", "128")))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    items = _read_items(args.items)
+    retriever = CandidateRetriever(ItemEmbedder(args.dim), AnnIndex(args.dim), max_items=max(len(items), 1))
+    embedded = retriever.refresh(items)
+    retriever.save(args.out)
+    print(f"Indexed {embedded} items into {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@ from firebase_functions import firestore_fn, options
 from firebase_admin import firestore, initialize_app
 import logging
 
+from user_emails import process_welcome_email
+
 # Initialize Firebase Admin
 initialize_app()
 
@@ -11,25 +13,18 @@ def send_welcome_email(event: firestore_fn.Event[firestore_fn.DocumentSnapshot])
     try:
         # Get user data
         user_data = event.data.to_dict()
-        email = user_data.get('email')
-        username = user_data.get('displayName', 'Creator')
         user_id = event.params['userId']
         
-        if not email:
-            logging.error("No email found for user")
+        # Queue the welcome email in the outbox (sent by drain_mail_outbox)
+        db = firestore.client()
+        update = process_welcome_email(db, user_id, user_data)
+        if update is None:
             return
         
-        # Log the welcome email (you'd integrate with email service)
-        logging.info(f"🎬 Welcome email for {username} ({email})")
-        logging.info(f"Beautiful MyChannel email would be sent here!")
-        
         # Update user document
-        firestore.client().collection('users').document(user_id).update({
-            'welcome_email_sent': True,
-            'welcome_email_sent_at': firestore.SERVER_TIMESTAMP
-        })
+        db.collection('users').document(user_id).update(update)
         
-        print(f"✅ Welcome email processed for {username}")
+        print(f"✅ Welcome email processed for {user_data.get('displayName', 'Creator')}")
         
     except Exception as e:
         logging.error(f"❌ Error: {str(e)}")
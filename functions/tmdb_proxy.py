@@ -1,8 +1,9 @@
 import os
 import requests
-import json
 from flask import Request
 
+from http_encoding import encode_json
+
 def tmdb_free_ads_proxy(request: Request):
     """Simple proxy for TMDB free/ads movies that works with Gen1 functions."""
     # Set CORS headers
@@ -18,7 +19,7 @@ def tmdb_free_ads_proxy(request: Request):
     try:
         api_key = os.environ.get("TMDB_API_KEY", "")
         if not api_key:
-            return (json.dumps({"error": "Missing TMDB API key"}), 500, headers)
+            return encode_json(request, {"error": "Missing TMDB API key"}, status=500, headers=headers)
 
         page = request.args.get("page", "1")
         region = request.args.get("region", "US")
@@ -52,6 +53,6 @@ def tmdb_free_ads_proxy(request: Request):
                 "release_date": m.get("release_date", "")
             })
 
-        return (json.dumps({"items": items}), 200, headers)
+        return encode_json(request, {"items": items}, status=200, headers=headers)
     except Exception as e:
-        return (json.dumps({"error": str(e)}), 500, headers)
+        return encode_json(request, {"error": str(e)}, status=500, headers=headers)
@@ -0,0 +1,64 @@
+# Shared welcome/verification email bookkeeping for triggers and backfills
+import logging
+import os
+from typing import Dict, Any, Optional
+
+from firebase_admin import firestore
+
+from mail_outbox import enqueue, outbox_message
+from mail_templates import get_engine
+
+APP_URL = os.environ.get("APP_URL", "https://mychannel.live")
+
+
+def welcome_email_fields(language: str) -> Dict[str, Any]:
+    """User-document update recording that the welcome email went out."""
+    return {
+        'welcome_email_sent': True,
+        'welcome_email_sent_at': firestore.SERVER_TIMESTAMP,
+        'email_language': language
+    }
+
+
+def thank_you_email_fields() -> Dict[str, Any]:
+    return {
+        'thank_you_email_sent': True,
+        'thank_you_email_sent_at': firestore.SERVER_TIMESTAMP
+    }
+
+
+def render_email(kind: str, user_id: str, user_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Render the `welcome`/`verified` template for one user into an outbox message; None if there is no address."""
+    email = user_data.get('email')
+    if not email:
+        return None
+    language = user_data.get('preferredLanguage', 'en')
+    subject, html = get_engine().render(kind, language, {
+        'username': user_data.get('displayName', 'Creator'),
+        'email': email,
+        'app_url': APP_URL,
+    })
+    return outbox_message(kind, user_id, email, subject, html, language)
+
+
+def process_welcome_email(db, user_id: str, user_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Queue the welcome email for one user; returns the user-document update, or None if there is no address."""
+    message = render_email('welcome', user_id, user_data)
+    if message is None:
+        logging.error(f"No email found for user {user_id}")
+        return None
+
+    if enqueue(db, message):
+        logging.info(f"🎬 Welcome email queued for {message['to']} in {message['language']}")
+    return welcome_email_fields(message['language'])
+
+
+def process_thank_you_email(db, user_id: str, user_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Queue the post-verification email for one user; returns the user-document update."""
+    message = render_email('verified', user_id, user_data)
+    if message is None:
+        return None
+
+    if enqueue(db, message):
+        logging.info(f"🎉 Thank you email queued for verified user {message['to']} in {message['language']}")
+    return thank_you_email_fields()
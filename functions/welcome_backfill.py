@@ -0,0 +1,170 @@
+# Backfill welcome emails for users created while ENABLE_EMAIL_TRIGGERS was off.
+# Run from functions/:
+#
+#   python welcome_backfill.py --project mychannel-ca26d
+#   python welcome_backfill.py --emulator localhost:8080 --project demo-mychannel --dry-run
+#
+# Pages through `users` by document id (cursor paging, so cost stays linear), renders each
+# page and commits outbox messages plus user flags through a BulkWriter; the next page is
+# read in the background while the current page's writes flush. Outbox
+# ids are deterministic (create fails if the email is already queued) and every user update
+# carries a last-update-time precondition, so a user the live trigger (or a concurrent run)
+# already handled is skipped rather than emailed twice; re-running the command is safe.
+# Queued messages are sent by the drain_mail_outbox schedule (deploy with ENABLE_MAIL_DRAIN=true).
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional
+
+from mail_outbox import OUTBOX_COLLECTION, outbox_id
+from user_emails import render_email, welcome_email_fields
+
+# Only the fields the email step needs; keeps page reads small
+_SELECT_FIELDS = ['email', 'displayName', 'preferredLanguage', 'welcome_email_sent']
+
+
+def iter_pending_users(db, page_size: int) -> Iterator[List[Any]]:
+    """Yield pages of user snapshots that have no welcome_email_sent field.
+
+    Firestore cannot query for a missing field, so each page is filtered client-side;
+    start_after() on the last document id keeps every page read O(page_size).
+    """
+    query = db.collection('users').select(_SELECT_FIELDS).order_by('__name__').limit(page_size)
+    cursor = None
+    while True:
+        page = list((query.start_after(cursor) if cursor is not None else query).stream())
+        if not page:
+            return
+        pending = [snap for snap in page if 'welcome_email_sent' not in (snap.to_dict() or {})]
+        if pending:
+            yield pending
+        if len(page) < page_size:
+            return
+        cursor = page[-1]
+
+
+class BackfillStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.scanned = 0
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'scanned': self.scanned, 'written': self.written, 'skipped': self.skipped, 'failed': self.failed}
+
+
+def _prefetched(pages: Iterator[List[Any]]) -> Iterator[List[Any]]:
+    """Yield from `pages`, reading the next page on a background thread while the caller
+    works on (and flushes) the current one."""
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='backfill-read') as reader:
+        upcoming = reader.submit(next, pages, None)
+        while True:
+            page = upcoming.result()
+            if page is None:
+                return
+            upcoming = reader.submit(next, pages, None)
+            yield page
+
+
+def _render(snap) -> Optional[Dict[str, Any]]:
+    try:
+        return render_email('welcome', snap.id, snap.to_dict() or {})
+    except Exception as e:
+        logging.error(f"❌ Error rendering welcome email for {snap.id}: {str(e)}")
+        return None
+
+
+def run_backfill(db, page_size: int = 500, limit: Optional[int] = None, dry_run: bool = False) -> Dict[str, int]:
+    from google.rpc import code_pb2
+
+    stats = BackfillStats()
+    writer = None
+    if not dry_run:
+        writer = db.bulk_writer()
+
+        def on_result(reference, result, bulk_writer) -> None:
+            if reference.parent.id == 'users':
+                stats.add(written=1)
+
+        def on_error(failure, bulk_writer) -> bool:
+            # Already queued / user changed since we read it (e.g. the trigger ran): never retry
+            # those; let BulkWriter retry transient errors a few times.
+            if failure.code == code_pb2.ALREADY_EXISTS:
+                return False
+            if failure.code == code_pb2.FAILED_PRECONDITION:
+                stats.add(skipped=1)
+                return False
+            if failure.attempts >= 5:
+                logging.error(f"❌ Backfill write failed for {failure.operation.reference.id}: {failure.message}")
+                stats.add(failed=1)
+                return False
+            return True
+
+        writer.on_write_result(on_result)
+        writer.on_write_error(on_error)
+
+    started = time.time()
+    for page in _prefetched(iter_pending_users(db, page_size)):
+        if limit is not None:
+            page = page[: max(0, limit - stats.scanned)]
+            if not page:
+                break
+        stats.add(scanned=len(page))
+        if dry_run:
+            stats.add(written=sum(1 for snap in page if (snap.to_dict() or {}).get('email')))
+            continue
+        # Rendering is CPU-bound (and holds the GIL), so it stays on this thread
+        for snap in page:
+            message = _render(snap)
+            if message is None:
+                stats.add(skipped=1)
+                continue
+            writer.create(db.collection(OUTBOX_COLLECTION).document(outbox_id('welcome', snap.id)), message)
+            writer.update(snap.reference, welcome_email_fields(message['language']),
+                          option=db.write_option(last_update_time=snap.update_time))
+        # The next page is already being read while this one commits
+        writer.flush()
+        logging.info(f"Backfill progress: {stats.as_dict()} ({time.time() - started:.1f}s)")
+
+    if writer is not None:
+        writer.close()
+    return stats.as_dict()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Queue welcome emails for users that never received one.")
+    parser.add_argument('--project', default=os.environ.get('GOOGLE_CLOUD_PROJECT') or os.environ.get('GCP_PROJECT'))
+    parser.add_argument('--emulator', help="Firestore emulator host:port (sets FIRESTORE_EMULATOR_HOST)")
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--limit', type=int, default=None, help="Stop after this many pending users")
+    parser.add_argument('--dry-run', action='store_true', help="Count pending users without queueing or writing")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.emulator:
+        os.environ['FIRESTORE_EMULATOR_HOST'] = args.emulator
+
+    if os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        # The emulator needs no credentials; skip Admin SDK default-credential lookup
+        from google.cloud import firestore as gfirestore
+        db = gfirestore.Client(project=args.project or 'demo-mychannel')
+    else:
+        from firebase_admin import initialize_app, firestore
+        initialize_app(options={'projectId': args.project} if args.project else None)
+        db = firestore.client()
+    stats = run_backfill(db, page_size=args.page_size, limit=args.limit, dry_run=args.dry_run)
+    print(f"✅ Welcome email backfill done: {stats}")
+
+
+if __name__ == '__main__':
+    main()